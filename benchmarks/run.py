@@ -0,0 +1,194 @@
+"""
+Times the hot paths on synthetic data and appends the results to data/benchmarks.jsonl
+python -m benchmarks.run --rows 1000 10000 100000
+Each result is compared against the last one recorded for the same benchmark and size
+"""
+
+import argparse
+import json
+import platform
+import random
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable
+
+from benchmarks.synthetic import generate_ledger, generate_prices
+from classes.json_cache import JsonCache
+from classes.json_log import JsonLog
+from classes.price_store import PriceStore
+from classes.services.gecko_service import GeckoService
+from classes.services.kraken_service import HistoryTable
+from config import paths
+from config.gecko_currency_map import K2G_ID_MAP
+from tools.calc_wallet import HistoryParser, Wallet
+from tools.gains_engine import compute_gains
+
+RESULTS_FILE = paths.DATA_DIR / "benchmarks.jsonl"
+
+# number of _get_closest_rate lookups per run, independent of the ledger size
+RATE_LOOKUPS = 10000
+
+
+class Fixture:
+    """Synthetic ledger + prices for one size, built once and shared by every benchmark"""
+
+    def __init__(self, rows: int, tmp: Path) -> None:
+        self.rows = generate_ledger(rows)
+        self.history = HistoryTable.from_raw(self.rows)
+        self.tsns = HistoryParser.parse_history(self.history)
+        self.tmp = tmp
+
+        # written up front, so the resume benchmark only times loading it
+        self.checkpoint = JsonLog(tmp / "checkpoint.jsonl")
+        Wallet.from_history(self.history, checkpoint=self.checkpoint)
+
+        start, end = self.history.time[0], self.history.time[-1]
+        self.end = end
+
+        # a gecko service that reads synthetic prices and never has to fetch
+        store = PriceStore(tmp / "prices")
+        span = (start - 86400, end + 86400)
+        for coin, (times, prices) in generate_prices(*span).items():
+            store.merge(coin, "usd", list(zip(times, prices)), [list(span)])
+        self.gecko = GeckoService()
+        self.gecko.PRICE_STORE = store  # type: ignore
+
+        rng = random.Random(0)
+        coins = [K2G_ID_MAP[x] for x in ["XXBT", "XETH", "ADA", "DOT"]]
+        self.lookups = [
+            (rng.uniform(start, end), rng.choice(coins)) for _ in range(RATE_LOOKUPS)
+        ]
+
+
+def bench_parse_history(fx: Fixture) -> None:
+    HistoryParser.parse_history(fx.history)
+
+
+def bench_replay(fx: Fixture) -> None:
+    wallet = Wallet()
+    for tsn in fx.tsns:
+        wallet.transact(tsn)
+
+
+def bench_from_history(fx: Fixture) -> None:
+    Wallet.from_history(fx.history)
+
+
+def bench_resume(fx: Fixture) -> None:
+    Wallet.from_history(fx.history, checkpoint=fx.checkpoint)
+
+
+def bench_closest_rate(fx: Fixture) -> None:
+    for ts, coin in fx.lookups:
+        fx.gecko._get_closest_rate(ts, coin, "usd")
+
+
+def bench_json_cache(fx: Fixture) -> None:
+    cache = JsonCache(fx.tmp / "history.json", default=list)
+    cache.dump(fx.rows)
+    cache.load()
+
+
+def bench_gains(fx: Fixture) -> None:
+    # includes the replay, compute_gains() needs a fresh wallet
+    wallet = Wallet.from_history(fx.history)
+    compute_gains(wallet, fx.gecko, K2G_ID_MAP, now=fx.end)
+
+
+BENCHMARKS: dict[str, Callable[[Fixture], None]] = {
+    "parse_history": bench_parse_history,
+    "replay": bench_replay,
+    "from_history": bench_from_history,
+    "resume": bench_resume,
+    "closest_rate": bench_closest_rate,
+    "json_cache": bench_json_cache,
+    "gains": bench_gains,
+}
+
+
+def measure(fn: Callable[[Fixture], None], fx: Fixture, repeat: int) -> float:
+    """Best wall time of {repeat} runs, in seconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(fx)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def git_commit() -> str | None:
+    try:
+        proc = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=paths.ROOT_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return proc.stdout.strip()
+
+
+def load_results(fp: Path) -> list[dict]:
+    if not fp.exists():
+        return []
+    with open(fp, encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="benchmarks")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--only", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS)
+    )
+    parser.add_argument("--output", type=Path, default=RESULTS_FILE)
+    parser.add_argument(
+        "--no-save", action="store_true", help="don't record the results"
+    )
+    args = parser.parse_args(argv)
+
+    # (benchmark, rows) -> most recent previous result
+    previous = {(x["benchmark"], x["rows"]): x for x in load_results(args.output)}
+    commit = git_commit()
+    date = datetime.now(tz=timezone.utc).isoformat(timespec="seconds")
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in args.rows:
+            fx = Fixture(rows, Path(tmp) / str(rows))
+            for name in args.only:
+                seconds = measure(BENCHMARKS[name], fx, args.repeat)
+                results.append(
+                    dict(
+                        benchmark=name,
+                        rows=rows,
+                        seconds=seconds,
+                        commit=commit,
+                        date=date,
+                        python=platform.python_version(),
+                    )
+                )
+
+                prev = previous.get((name, rows))
+                change = ""
+                if prev:
+                    change = f"{seconds / prev['seconds']:>6.2f}x vs {prev['commit']}"
+                print(
+                    f"{name:<14} | {rows:>8} rows | {seconds * 1000:>10.1f} ms | {change}"
+                )
+
+    if not args.no_save:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, "a", encoding="utf-8") as file:
+            for result in results:
+                file.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
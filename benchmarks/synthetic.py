@@ -0,0 +1,151 @@
+import math
+import random
+from decimal import Decimal
+from dataclasses import dataclass, field
+
+from classes.services.kraken_service import HistoryTable
+from config.gecko_currency_map import K2G_ID_MAP
+
+# quote currency as it appears in the ledger
+QUOTE = "ZUSD"
+ASSETS = ["XXBT", "XETH", "ADA", "DOT", "ATOM", "SOL"]
+# balances are kept as ints counting the ledger's smallest amount
+UNIT = 10**HistoryTable.AMOUNT_SCALE
+
+# rough starting prices in usd, the series random-walk from there
+START_PRICES = {"XXBT": 10000, "XETH": 400, "ADA": 0.1, "DOT": 5, "ATOM": 5, "SOL": 3}
+
+
+@dataclass
+class LedgerGenerator:
+    """
+    Synthetic Kraken ledger in the cached format (list of dicts, oldest first)
+    Mixes deposits, trades, spend / receive pairs, staking rewards and withdrawals,
+    keeping running balances so the result replays without errors
+    """
+
+    seed: int = 1
+    start: float = 1.6e9
+    # mean seconds between entries
+    interval: float = 1800
+
+    # asset -> balance in int units
+    balances: dict[str, int] = field(default_factory=dict, init=False)
+    rows: list[dict] = field(default_factory=list, init=False)
+
+    def generate(self, n: int) -> list[dict]:
+        rng = random.Random(self.seed)
+        self.balances = {QUOTE: 0}
+        self.rows = []
+
+        t = self.start
+        while len(self.rows) < n:
+            t += rng.expovariate(1 / self.interval)
+            k = rng.random()
+
+            if len(self.rows) == n - 1:
+                # no room left for both legs of a trade / spend
+                self._staking(t, rng.choice(ASSETS), rng.uniform(0.0001, 0.01))
+            elif k < 0.1 or self.balances[QUOTE] < 100 * UNIT:
+                self._deposit(t, QUOTE, rng.uniform(100, 1000))
+            elif k < 0.5:
+                self._trade(t, rng.choice(ASSETS), rng.uniform(1, 50), rng)
+            elif k < 0.65:
+                self._spend(t, rng)
+            elif k < 0.9:
+                self._staking(t, rng.choice(ASSETS), rng.uniform(0.0001, 0.01))
+            else:
+                self._withdrawal(t, rng)
+
+        return self.rows
+
+    def _deposit(self, t: float, asset: str, amount: float) -> None:
+        self._add("deposit", asset, _units(amount, 2), 0, f"D{len(self.rows)}", t)
+
+    def _staking(self, t: float, asset: str, amount: float) -> None:
+        self._add("staking", asset, _units(amount, 8), 0, f"R{len(self.rows)}", t)
+
+    def _trade(self, t: float, asset: str, cost: float, rng: random.Random) -> None:
+        cost_units = _units(cost, 2)
+        fee = _units(0.1, 2)
+        if self.balances[QUOTE] < cost_units + fee:
+            return
+
+        refid = f"T{len(self.rows)}"
+        volume = _units(cost / START_PRICES[asset] * rng.uniform(0.8, 1.2), 8)
+        self._add("trade", QUOTE, -cost_units, fee, refid, t)
+        self._add("trade", asset, volume, 0, refid, t)
+
+    def _spend(self, t: float, rng: random.Random) -> None:
+        held = [x for x in ASSETS if self.balances.get(x, 0) > UNIT // 100]
+        if not held:
+            return
+
+        asset = rng.choice(held)
+        amount = int(self.balances[asset] * rng.uniform(0.1, 0.9))
+        proceeds = _units(rng.uniform(1, 50), 2)
+        fee = _units(0.05, 2)
+
+        refid = f"S{len(self.rows)}"
+        self._add("spend", asset, -amount, 0, refid, t)
+        self._add("receive", QUOTE, proceeds, fee, refid, t)
+
+    def _withdrawal(self, t: float, rng: random.Random) -> None:
+        held = [x for x in ASSETS if self.balances.get(x, 0) > UNIT // 100]
+        if not held:
+            return
+
+        asset = rng.choice(held)
+        amount = int(self.balances[asset] * rng.uniform(0.1, 0.5))
+        self._add("withdrawal", asset, -amount, 0, f"W{len(self.rows)}", t)
+
+    def _add(
+        self, type: str, asset: str, amount: int, fee: int, refid: str, t: float
+    ) -> None:
+        balance = self.balances.get(asset, 0) + amount - fee
+        self.balances[asset] = balance
+        self.rows.append(
+            dict(
+                aclass="currency",
+                amount=_text(amount),
+                asset=asset,
+                balance=_text(balance),
+                fee=_text(fee),
+                refid=refid,
+                time=round(t, 4),
+                type=type,
+                subtype="",
+                id=f"L{len(self.rows):09d}",
+            )
+        )
+
+
+def _units(amount: float, places: int) -> int:
+    return int(Decimal(f"{amount:.{places}f}").scaleb(HistoryTable.AMOUNT_SCALE))
+
+
+def _text(units: int) -> str:
+    return format(Decimal(units).scaleb(-HistoryTable.AMOUNT_SCALE), "f")
+
+
+def generate_ledger(n: int, seed=1) -> list[dict]:
+    return LedgerGenerator(seed=seed).generate(n)
+
+
+def generate_prices(
+    start: float, end: float, step=3600, seed=1
+) -> dict[str, tuple[list[int], list[float]]]:
+    """coingecko id -> (ms timestamps, usd prices), a geometric random walk per asset covering [start, end]"""
+    rng = random.Random(seed)
+    count = math.ceil((end - start) / step) + 1
+    times = [int((start + idx * step) * 1000) for idx in range(count)]
+
+    result = dict()
+    for asset in ASSETS:
+        price = START_PRICES[asset]
+        prices = []
+        for _ in times:
+            price *= math.exp(rng.gauss(0, 0.01))
+            prices.append(price)
+        result[K2G_ID_MAP[asset]] = (times, prices)
+    return result
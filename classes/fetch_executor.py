@@ -0,0 +1,26 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, TypeVar
+
+T = TypeVar("T")
+
+
+class FetchExecutor:
+    """
+    Runs independent requests on a small thread pool
+    Pacing is left to the @limit'd functions being called, so up to max_in_flight requests
+    can be waiting on their slot / the network at the same time
+    """
+
+    def __init__(self, max_in_flight: int = 4) -> None:
+        self.max_in_flight = max_in_flight
+
+    def map(self, fn: Callable[..., T], *iterables: Iterable) -> list[T]:
+        """Like map(), but concurrent; results keep the input order and the first error is re-raised"""
+        args = list(zip(*iterables))
+        if len(args) <= 1 or self.max_in_flight <= 1:
+            return [fn(*a) for a in args]
+
+        workers = min(self.max_in_flight, len(args))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(fn, *a) for a in args]
+            return [f.result() for f in futures]
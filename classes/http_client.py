@@ -0,0 +1,123 @@
+import logging
+import time
+from email.utils import parsedate_to_datetime
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import requests
+
+LOG = logging.getLogger(__name__)
+
+
+class HttpClient:
+    """
+    Shared HTTP layer for the services
+    One pooled keep-alive session, compressed responses, a default timeout,
+    and retries with exponential backoff on 429 / 5xx that honor Retry-After
+    """
+
+    # responses worth retrying, the request wasn't processed
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(
+        self,
+        timeout: float = 30,
+        max_retries: int = 5,
+        # first backoff in seconds, doubled on every retry
+        backoff: float = 1,
+        max_backoff: float = 120,
+        pool_size: int = 4,
+        session: "requests.Session | None" = None,
+    ) -> None:
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.pool_size = pool_size
+        self._session = session
+
+    @property
+    def session(self) -> "requests.Session":
+        # requests is slow to import, only pay for it once something is actually sent
+        if self._session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=self.pool_size, pool_maxsize=self.pool_size
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers["Accept-Encoding"] = "gzip, deflate"
+            self._session = session
+        return self._session
+
+    def get(self, url: str, **kwargs) -> "requests.Response":
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> "requests.Response":
+        return self.request("POST", url, **kwargs)
+
+    def request(
+        self, method: str, url: str, max_retries: int | None = None, **kwargs
+    ) -> "requests.Response":
+        """
+        Sends the request, retrying throttled / failed attempts up to max_retries times
+        Raises requests.HTTPError if the last attempt still failed
+        Requests that can't be resent as-is (eg. signed with a nonce) should pass max_retries=0 and retry themselves
+        """
+        import requests
+
+        if max_retries is None:
+            max_retries = self.max_retries
+        kwargs.setdefault("timeout", self.timeout)
+
+        attempt = 0
+        while True:
+            try:
+                resp = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= max_retries:
+                    raise
+                delay = self.delay(attempt)
+                LOG.warning(f"{method} {url} failed ({e}), retrying in {delay:.1f}s")
+            else:
+                if resp.status_code not in self.RETRY_STATUSES:
+                    return resp
+                if attempt >= max_retries:
+                    resp.raise_for_status()
+                    return resp
+                delay = self.delay(attempt, resp.headers.get("Retry-After"))
+                LOG.warning(
+                    f"{method} {url} returned {resp.status_code}, retrying in {delay:.1f}s"
+                )
+
+            self.wait(delay)
+            attempt += 1
+
+    def delay(self, attempt: int, retry_after: str | None = None) -> float:
+        """Seconds to wait before retry number {attempt + 1}"""
+        if retry_after is not None:
+            seconds = _parse_retry_after(retry_after)
+            if seconds is not None:
+                return min(seconds, self.max_backoff)
+        return min(self.backoff * 2**attempt, self.max_backoff)
+
+    def wait(self, seconds: float) -> None:
+        if seconds > 0:
+            time.sleep(seconds)
+
+
+def _parse_retry_after(value: str) -> float | None:
+    """Retry-After is either a number of seconds or an http date"""
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(date.timestamp() - time.time(), 0)
@@ -4,14 +4,22 @@ import os
 from pathlib import Path
 from typing import Callable, Union
 
+from utils import instrument
+from utils.misc import atomic_write
+
 
 @dataclass
 class JsonCache:
     fp: Union[str, Path]
     default: Union[Callable[[], list | dict], list | dict]
+    indent: int | None = 2
     encoding = "utf-8"
 
     def load(self) -> list | dict:
+        with instrument.stage("json_cache.load"):
+            return self._load()
+
+    def _load(self) -> list | dict:
         import json
 
         if not isinstance(self.fp, Path):
@@ -30,5 +38,11 @@ class JsonCache:
         return result
 
     def dump(self, data: Union[list, dict]):
-        with open(self.fp, "w+", encoding=self.encoding) as file:
-            json.dump(data, file, indent=2)
+        with instrument.stage("json_cache.dump"):
+            self._dump(data)
+
+    def _dump(self, data: Union[list, dict]):
+        if not isinstance(self.fp, Path):
+            self.fp = Path(self.fp)
+        with atomic_write(self.fp, "w", encoding=self.encoding) as file:
+            json.dump(data, file, indent=self.indent)
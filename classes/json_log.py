@@ -0,0 +1,78 @@
+from dataclasses import dataclass
+import json
+import os
+from pathlib import Path
+from typing import Union
+
+from classes.json_cache import JsonCache
+from utils import instrument
+from utils.misc import atomic_write
+
+
+@dataclass
+class JsonLog:
+    """
+    Append-only file of json entries, one per line, so adding to it doesn't rewrite what's already there
+    A {name}.meta.json sidecar holds the caller's header and how many bytes of the log are valid,
+    it's swapped in after every write, so an append cut short by a crash is dropped on the next load
+    """
+
+    fp: Union[str, Path]
+    encoding = "utf-8"
+
+    def header(self) -> dict:
+        """Header passed to the last append() / dump(), empty if nothing was written yet"""
+        return self._meta().get("header", {})
+
+    def load(self) -> list:
+        with instrument.stage("json_log.load"):
+            return self._load()
+
+    def _load(self) -> list:
+        size = self._meta().get("size", 0)
+        try:
+            with open(self._path(), "rb") as file:
+                data = file.read(size)
+        except FileNotFoundError:
+            return []
+        if len(data) < size:
+            # shorter than the sidecar says, something else rewrote it
+            return []
+        return [json.loads(line) for line in data.decode(self.encoding).splitlines()]
+
+    def append(self, entry: Union[list, dict], header: dict) -> None:
+        """Adds an entry after the valid part of the log and replaces the header"""
+        with instrument.stage("json_log.append"):
+            size = self._meta().get("size", 0)
+            line = self._encode(entry)
+            mode = "r+b" if self._path().exists() else "wb"
+            with open(self._path(), mode) as file:
+                file.truncate(size)
+                file.seek(size)
+                file.write(line)
+                file.flush()
+                os.fsync(file.fileno())
+            self._meta_cache().dump(dict(size=size + len(line), header=header))
+
+    def dump(self, entries: list, header: dict) -> None:
+        """Replaces the whole log"""
+        with instrument.stage("json_log.dump"):
+            data = b"".join(self._encode(x) for x in entries)
+            with atomic_write(self._path()) as file:
+                file.write(data)
+            self._meta_cache().dump(dict(size=len(data), header=header))
+
+    def _encode(self, entry: Union[list, dict]) -> bytes:
+        return (json.dumps(entry, separators=(",", ":")) + "\n").encode(self.encoding)
+
+    def _meta(self) -> dict:
+        return self._meta_cache().load()  # type: ignore
+
+    def _meta_cache(self) -> JsonCache:
+        path = self._path()
+        return JsonCache(path.with_name(path.stem + ".meta.json"), default=dict, indent=None)
+
+    def _path(self) -> Path:
+        if not isinstance(self.fp, Path):
+            self.fp = Path(self.fp)
+        return self.fp
@@ -1,17 +1,15 @@
 from decimal import Decimal
 from dataclasses import dataclass
-import dataclasses
 
 
-@dataclass
+@dataclass(slots=True, eq=False)
 class Value:
     quantity: Decimal
     currency: str
 
     def __mul__(self, other: Decimal | int) -> "Value":
         if isinstance(other, Decimal) or isinstance(other, int):
-            q = other * self.quantity
-            return dataclasses.replace(self, quantity=q)
+            return Value(other * self.quantity, self.currency)
         else:
             raise NotImplementedError
 
@@ -19,10 +17,10 @@ class Value:
         return self.__mul__(other)
 
     def __eq__(self, other: "Value") -> bool:
-        return all([self.quantity == other.quantity, self.currency == other.currency])
+        return self.quantity == other.quantity and self.currency == other.currency
 
     def __hash__(self) -> int:
-        return hash(f"{self.quantity}_{self.currency}")
+        return hash((self.quantity, self.currency))
 
     def __repr__(self):
         return f"{self.quantity:.3f} {self.currency}"
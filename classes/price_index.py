@@ -0,0 +1,87 @@
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import Sequence
+
+
+@dataclass
+class PriceIndex:
+    """
+    Sorted view of a price series for O(log n) closest-sample lookups
+    times are unix timestamps multiplied by scale (so scale=1000 for milliseconds), prices are the raw cached values
+    Any indexable sequence works for either, including memoryviews over a PriceStore file
+    """
+
+    times: Sequence[float] = field(default_factory=list)
+    prices: Sequence = field(default_factory=list)
+    scale: float = 1
+
+    def closest(self, timestamp: float) -> tuple[Decimal, float]:
+        idx = self._closest_idx(timestamp)
+        return (Decimal(self.prices[idx]), timestamp - self.times[idx] / self.scale)
+
+    def interpolate(self, timestamp: float) -> tuple[Decimal, float]:
+        """
+        Linear interpolation between the samples on either side of timestamp
+        time_diff is still the distance to the closest sample, lookups outside the series get the closest one
+        """
+        idx = self._closest_idx(timestamp)
+        time_diff = timestamp - self.times[idx] / self.scale
+
+        # index of the sample right after timestamp
+        after = idx + 1 if time_diff > 0 else idx
+        if after == 0 or after == len(self.times) or time_diff == 0:
+            return (Decimal(self.prices[idx]), time_diff)
+
+        t0, t1 = self.times[after - 1] / self.scale, self.times[after] / self.scale
+        p0, p1 = Decimal(self.prices[after - 1]), Decimal(self.prices[after])
+        frac = Decimal(timestamp - t0) / Decimal(t1 - t0)
+        return (p0 + (p1 - p0) * frac, time_diff)
+
+    def closest_many(self, timestamps: list[float]) -> list[tuple[Decimal, float]]:
+        """Same as closest() for each timestamp, in a single sweep over the sorted queries"""
+        if not self.times:
+            raise KeyError("empty price index")
+
+        result: list = [None] * len(timestamps)
+        order = sorted(range(len(timestamps)), key=timestamps.__getitem__)
+
+        times = self.times
+        scale = self.scale
+        last = len(times) - 1
+        idx = 0
+        for q in order:
+            timestamp = timestamps[q]
+            # queries are visited in order, so each search can start where the last one ended
+            idx = bisect_left(times, timestamp * scale, idx)
+
+            if idx == 0:
+                best = 0
+            elif idx > last:
+                best = last
+            elif timestamp - times[idx - 1] / scale <= times[idx] / scale - timestamp:
+                best = idx - 1
+            else:
+                best = idx
+
+            result[q] = (Decimal(self.prices[best]), timestamp - times[best] / scale)
+
+        return result
+
+    def _closest_idx(self, timestamp: float) -> int:
+        if not self.times:
+            raise KeyError("empty price index")
+
+        idx = bisect_left(self.times, timestamp * self.scale)
+        if idx == 0:
+            return 0
+        if idx == len(self.times):
+            return idx - 1
+
+        # ties go to the earlier sample, same as min() over the sorted keys
+        before = timestamp - self.times[idx - 1] / self.scale
+        after = self.times[idx] / self.scale - timestamp
+        return idx - 1 if before <= after else idx
+
+    def __len__(self):
+        return len(self.times)
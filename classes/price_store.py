@@ -0,0 +1,190 @@
+import logging
+import mmap
+import os
+import struct
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Union
+
+from classes.json_cache import JsonCache
+from classes.price_index import PriceIndex
+from classes.sqlite_cache import SqliteCache
+from utils.misc import atomic_write
+
+LOG = logging.getLogger(__name__)
+
+
+@dataclass
+class PriceSeries:
+    """
+    Read-only view of one pair's price file
+    times are millisecond timestamps (int64), prices are float64, both ascending by time
+    The arrays are memoryviews over the mmap'd file, so slicing them doesn't copy anything
+    """
+
+    times: memoryview | list[int]
+    prices: memoryview | list[float]
+    # time ranges (in seconds) that were fetched, whether or not they contained samples
+    coverage: list[list[float]]
+
+    index: PriceIndex = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.index = PriceIndex(times=self.times, prices=self.prices, scale=1000)
+
+    def slice(
+        self, start: float, end: float
+    ) -> tuple[memoryview | list, memoryview | list]:
+        """(times, prices) of the samples in [start, end], in seconds"""
+        lo = bisect_left(self.times, start * 1000)
+        hi = bisect_right(self.times, end * 1000)
+        return self.times[lo:hi], self.prices[lo:hi]
+
+    def __len__(self):
+        return len(self.times)
+
+
+@dataclass
+class PriceStore:
+    """
+    One binary file per (src, dst) pair, at {root}/{src}/{dst}.bin, plus a {dst}.coverage.json sidecar
+    A file is a header (magic, sample count) followed by the int64 timestamps and then the float64 prices,
+    in native byte order. Files are only opened (and mapped) when a pair is first used.
+    """
+
+    root: Union[str, Path]
+    # imported into per-pair files the first time the store is used
+    legacy: SqliteCache | None = None
+
+    MAGIC = b"STNKPRC1"
+    HEADER = struct.Struct("=8sq")
+
+    # (src, dst) -> open series, dropped whenever the pair is rewritten
+    _series: dict[tuple[str, str], PriceSeries] = field(
+        default_factory=dict, init=False, repr=False
+    )
+    _imported: bool = field(default=False, init=False, repr=False)
+
+    def has(self, src: str, dst: str) -> bool:
+        """Whether the pair has any samples, a file without any counts as missing"""
+        self._import_legacy()
+        try:
+            return self._data_path(src, dst).stat().st_size > self.HEADER.size
+        except FileNotFoundError:
+            return False
+
+    def get(self, src: str, dst: str) -> PriceSeries:
+        """Series for the pair, empty if it was never fetched"""
+        self._import_legacy()
+
+        series = self._series.get((src, dst))
+        if series is None:
+            times, prices = self._read(self._data_path(src, dst))
+            # a range that came back empty is worth asking for again
+            coverage = self._coverage_cache(src, dst).load() if len(times) else []
+            series = PriceSeries(times=times, prices=prices, coverage=coverage)  # type: ignore
+            # pairs are only remembered once a fetch has written samples for them
+            if len(times):
+                self._series[(src, dst)] = series
+        return series
+
+    def merge(
+        self,
+        src: str,
+        dst: str,
+        samples: list[list[float]],
+        coverage: list[list[float]],
+    ) -> None:
+        """Adds [ms timestamp, price] samples (overwriting ones at the same time) and saves the new coverage"""
+        series = self.get(src, dst)
+        merged = dict(zip(series.times, series.prices))
+        merged.update((int(ts), float(price)) for ts, price in samples)
+        if not merged:
+            LOG.warning(f"No {src} / {dst} prices were returned, not saving the pair")
+            return
+        times = sorted(merged)
+
+        self._write(self._data_path(src, dst), times, [merged[ts] for ts in times])
+        self._coverage_cache(src, dst).dump(coverage)
+        self._series.pop((src, dst), None)
+
+    def _import_legacy(self) -> None:
+        if self._imported:
+            return
+        self._imported = True
+
+        marker = self._root() / ".imported"
+        if self.legacy is None or marker.exists():
+            return
+
+        data = self.legacy.load()
+        for src, by_dst in data.items():
+            for dst, pair in by_dst.items():
+                if self._data_path(src, dst).exists():
+                    continue
+
+                samples = sorted(
+                    (int(ts), float(price)) for ts, price in pair["prices"].items()
+                )
+                if not samples:
+                    continue
+                coverage = pair.get("coverage")
+                if coverage is None:
+                    # entries cached before coverage was tracked are assumed to span their samples
+                    times = [ts / 1000 for ts, _ in samples]
+                    coverage = [[min(times), max(times)]]
+
+                self._write(
+                    self._data_path(src, dst),
+                    [ts for ts, _ in samples],
+                    [price for _, price in samples],
+                )
+                self._coverage_cache(src, dst).dump(coverage)
+                LOG.info(
+                    f"Imported {len(samples)} {src} / {dst} prices from {self.legacy.fp}"
+                )
+
+        os.makedirs(marker.parent, exist_ok=True)
+        marker.touch()
+
+    def _read(self, fp: Path) -> tuple[memoryview | list, memoryview | list]:
+        try:
+            with open(fp, "rb") as file:
+                size = os.fstat(file.fileno()).st_size
+                if size <= self.HEADER.size:
+                    return [], []
+                buf = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return [], []
+
+        magic, count = self.HEADER.unpack_from(buf)
+        if magic != self.MAGIC or size != self.HEADER.size + 16 * count:
+            raise ValueError(f"{fp} is not a price file")
+
+        # the mapping stays alive for as long as a view over it does
+        view = memoryview(buf)
+        offset = self.HEADER.size
+        times = view[offset : offset + 8 * count].cast("q")
+        prices = view[offset + 8 * count :].cast("d")
+        return times, prices
+
+    def _write(self, fp: Path, times: list[int], prices: list[float]) -> None:
+        # replaced rather than rewritten in place, open mappings keep seeing the old file
+        with atomic_write(fp) as file:
+            file.write(self.HEADER.pack(self.MAGIC, len(times)))
+            file.write(struct.pack(f"={len(times)}q", *times))
+            file.write(struct.pack(f"={len(prices)}d", *prices))
+
+    def _coverage_cache(self, src: str, dst: str) -> JsonCache:
+        return JsonCache(
+            self._root() / src / f"{dst}.coverage.json", default=list, indent=None
+        )
+
+    def _data_path(self, src: str, dst: str) -> Path:
+        return self._root() / src / f"{dst}.bin"
+
+    def _root(self) -> Path:
+        if not isinstance(self.root, Path):
+            self.root = Path(self.root)
+        return self.root
@@ -0,0 +1,90 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+
+class RateLimiter:
+    """
+    Sliding-window limiter shared by every call in a scope
+    Callers reserve a start time under a lock and then wait outside of it,
+    so threads / tasks sharing the limiter queue up behind each other instead of all sleeping the same amount
+
+    If a path is set, the slots live in that file instead and are updated under an exclusive file lock,
+    so every local process using the same file divides one budget
+    """
+
+    def __init__(self, path: Path | str | None = None) -> None:
+        # reserved start times, ascending
+        self._slots: deque[float] = deque()
+        self._lock = threading.Lock()
+        self._max_period: float = 0
+        self.path = path
+
+    def reserve(self, calls: int, period: float) -> float:
+        """Claims the next slot that keeps at most {calls} starts per {period} seconds, returns the seconds until it"""
+        with self._lock:
+            if self.path is None:
+                return self._reserve(calls, period)
+            return self._reserve_shared(calls, period)
+
+    def _reserve(self, calls: int, period: float) -> float:
+        now = time.time()
+        self._max_period = max(self._max_period, period)
+
+        slots = self._slots
+        while slots and slots[0] <= now - self._max_period:
+            slots.popleft()
+
+        slot = max(now, slots[-1]) if slots else now
+        if len(slots) >= calls:
+            slot = max(slot, slots[-calls] + period)
+
+        slots.append(slot)
+        return slot - now
+
+    def _reserve_shared(self, calls: int, period: float) -> float:
+        import fcntl
+
+        path = Path(self.path)  # type: ignore
+        os.makedirs(path.parent, exist_ok=True)
+
+        with open(path, "a+", encoding="utf-8") as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                file.seek(0)
+                try:
+                    state = json.loads(file.read() or "{}")
+                except json.JSONDecodeError:
+                    state = {}
+
+                # other processes may have reserved slots since the last call
+                self._slots = deque(state.get("slots", []))
+                self._max_period = max(self._max_period, state.get("max_period", 0))
+                delay = self._reserve(calls, period)
+
+                file.seek(0)
+                file.truncate()
+                json.dump(dict(slots=list(self._slots), max_period=self._max_period), file)
+                file.flush()
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+        return delay
+
+    def acquire(self, calls: int, period: float) -> float:
+        """Waits for the next slot, returns the seconds spent waiting"""
+        delay = self.reserve(calls, period)
+        if delay > 0:
+            time.sleep(delay)
+        return max(delay, 0)
+
+    async def acquire_async(self, calls: int, period: float) -> float:
+        import asyncio
+
+        delay = self.reserve(calls, period)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return max(delay, 0)
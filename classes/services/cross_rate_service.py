@@ -0,0 +1,85 @@
+from decimal import Decimal
+from typing import Iterable
+
+from .rate_service import RateService, StalenessPolicy
+
+
+class CrossRateService(RateService):
+    """
+    Derives any src / dst rate from the src / quote and dst / quote series of another service
+    So only one series per coin is ever fetched and cached, instead of one per pair
+    Both legs are looked up at the same timestamp, and the reported time_diff is the worse of the two
+    """
+
+    def __init__(self, base: RateService, quote="usd") -> None:
+        self.base = base
+        self.quote = quote
+
+    def get_rate(
+        self, timestamp: float, src: str, dst: str, live=False, **kwargs
+    ) -> tuple[Decimal, float]:
+        """kwargs (staleness, interpolate) are passed through to the base service for both legs"""
+        if src == dst:
+            return (Decimal(1), 0)
+        if dst == self.quote:
+            return self._leg(timestamp, src, live, **kwargs)
+
+        src_rate, src_diff = self._leg(timestamp, src, live, **kwargs)
+        dst_rate, dst_diff = self._leg(timestamp, dst, live, **kwargs)
+        return (src_rate / dst_rate, _worst(src_diff, dst_diff))
+
+    def prefetch(
+        self,
+        lookups: Iterable[tuple[float, str]],
+        dst: str,
+        staleness: StalenessPolicy | None = None,
+    ) -> None:
+        self.base.prefetch(self._legs(lookups, dst), self.quote, staleness=staleness)
+
+    def get_rates(
+        self,
+        lookups: Iterable[tuple[float, str]],
+        dst: str,
+        staleness: StalenessPolicy | None = None,
+    ) -> dict[tuple[float, str], tuple[Decimal, float]]:
+        lookups = set(lookups)
+        legs = self.base.get_rates(
+            self._legs(lookups, dst), self.quote, staleness=staleness
+        )
+        legs.update({(ts, self.quote): (Decimal(1), 0) for ts, _ in lookups})
+
+        result = dict()
+        for ts, src in lookups:
+            if src == dst:
+                result[(ts, src)] = (Decimal(1), 0)
+                continue
+
+            src_rate, src_diff = legs[(ts, src)]
+            dst_rate, dst_diff = legs[(ts, dst)]
+            result[(ts, src)] = (src_rate / dst_rate, _worst(src_diff, dst_diff))
+        return result
+
+    def _leg(
+        self, timestamp: float, coin: str, live: bool, **kwargs
+    ) -> tuple[Decimal, float]:
+        if coin == self.quote:
+            return (Decimal(1), 0)
+        return self.base.get_rate(timestamp, coin, self.quote, live=live, **kwargs)  # type: ignore
+
+    def _legs(
+        self, lookups: Iterable[tuple[float, str]], dst: str
+    ) -> set[tuple[float, str]]:
+        """(timestamp, coin) lookups against the quote currency needed to answer lookups in dst"""
+        result = set()
+        for ts, src in lookups:
+            if src == dst:
+                continue
+            if src != self.quote:
+                result.add((ts, src))
+            if dst != self.quote:
+                result.add((ts, dst))
+        return result
+
+
+def _worst(a: float, b: float) -> float:
+    return a if abs(a) >= abs(b) else b
@@ -1,75 +1,277 @@
 import logging
+import time
 from datetime import datetime
 from math import ceil
+from typing import Iterable
 
-import requests
 from decimal import Decimal
+from classes.fetch_executor import FetchExecutor
+from classes.http_client import HttpClient
 from classes.json_cache import JsonCache
+from classes.price_index import PriceIndex
+from classes.price_store import PriceStore
+from classes.sqlite_cache import SqliteCache
 from config import paths
+from utils import instrument
 from utils.misc import limit
-from yarl import URL
 
-from .rate_service import RateService
+from .rate_service import RateService, StalenessPolicy
 
 LOG = logging.getLogger(__name__)
 
 
 class GeckoService(RateService):
-    session: requests.Session
-    api_url = URL("https://api.coingecko.com/api/v3")
+    api_url = "https://api.coingecko.com/api/v3"
 
-    PRICE_CACHE = JsonCache(paths.CACHE_DIR / "gecko" / "prices.json", default={})
-    price_data: dict = PRICE_CACHE.load()
+    # pairs are only read from disk when first looked up
+    PRICE_STORE = PriceStore(
+        paths.CACHE_DIR / "gecko" / "prices",
+        legacy=SqliteCache(
+            paths.CACHE_DIR / "gecko" / "cache.sqlite",
+            default={},
+            namespace="prices",
+            legacy=JsonCache(paths.CACHE_DIR / "gecko" / "prices.json", default={}),
+        ),
+    )
+    # concurrent range requests, they still start at most once per @limit period
+    MAX_IN_FLIGHT = 3
 
-    def __init__(self) -> None:
+    # seconds fetched on either side of a lookup, so point lookups still get a few samples around them
+    FETCH_PADDING = 86400
+
+    # used when a lookup doesn't bring its own
+    STALENESS = StalenessPolicy()
+
+    def __init__(
+        self,
+        http: HttpClient | None = None,
+        api_url: str | None = None,
+    ) -> None:
         super().__init__()
-        self.session = requests.session()
+        self.http = http or HttpClient(pool_size=self.MAX_IN_FLIGHT)
+        self.executor = FetchExecutor(self.MAX_IN_FLIGHT)
+        if api_url is not None:
+            self.api_url = str(api_url)
+
+        # (src, dst) -> start of the range already refreshed up to now by this instance
+        self._refreshed: dict[tuple[str, str], float] = dict()
 
     # timestamp is utc
     def get_rate(
-        self, timestamp, src: str, dst: str, live=False
+        self,
+        timestamp,
+        src: str,
+        dst: str,
+        live=False,
+        staleness: StalenessPolicy | None = None,
+        interpolate=False,
     ) -> tuple[Decimal, float]:
+        """
+        Rate at timestamp, served from the cache unless the pair was never fetched or the closest sample is stale
+        A stale lookup refreshes its pair at most once per run, anything still stale after that is logged (or raised if strict)
+        """
         if src == dst:
             return (Decimal(1), 0)
 
-        if live or self.price_data.get(src, dict()).get(dst) is None:
-            self._fetch_market_chart(src, dst, timestamp)
-            self.PRICE_CACHE.dump(self.price_data)
+        policy = staleness or self.STALENESS
+        now = time.time()
+
+        if live or not self.PRICE_STORE.has(src, dst):
+            self._refresh(src, dst, timestamp, now)
+
+        rate = self._lookup(timestamp, src, dst, interpolate)
+        if not policy.is_stale(timestamp, rate[1], now, refresh=True):
+            instrument.count("gecko.cache_hits")
+            return rate
+
+        if self._refresh(src, dst, timestamp, now):
+            rate = self._lookup(timestamp, src, dst, interpolate)
+
+        if policy.is_stale(timestamp, rate[1], now):
+            msg = f"Closest {src} / {dst} sample for {datetime.utcfromtimestamp(timestamp)} is {rate[1] / 3600:.1f} hours off"
+            if policy.strict:
+                raise ValueError(msg)
+            LOG.warning(msg)
+        return rate
+
+    def prefetch(
+        self,
+        lookups: Iterable[tuple[float, str]],
+        dst: str,
+        staleness: StalenessPolicy | None = None,
+    ) -> None:
+        """
+        Make sure every (timestamp, src) lookup can be answered from the cache
+        For each src, only the parts of [earliest stale lookup, latest stale lookup] that were never fetched are requested
+        """
+        policy = staleness or self.STALENESS
+        by_src: dict[str, list[float]] = dict()
+        for timestamp, src in lookups:
+            if src != dst:
+                by_src.setdefault(src, []).append(timestamp)
+
+        now = time.time()
+        ranges: list[tuple[str, str, float, float]] = []
+        for src, timestamps in by_src.items():
+            if not self.PRICE_STORE.has(src, dst):
+                stale = timestamps
+            else:
+                rates = self._get_index(src, dst).closest_many(timestamps)
+                stale = [
+                    ts
+                    for ts, (_, time_diff) in zip(timestamps, rates)
+                    if policy.is_stale(ts, time_diff, now, refresh=True)
+                ]
+
+            instrument.count("gecko.cache_misses", len(stale))
+            instrument.count("gecko.cache_hits", len(timestamps) - len(stale))
+            if stale:
+                start = min(stale) - self.FETCH_PADDING
+                end = min(max(stale) + self.FETCH_PADDING, now)
+                ranges += self._find_missing(src, dst, start, end)
+
+        instrument.count("gecko.prefetch_ranges", len(ranges))
+        self._fetch_all(ranges)
+
+    def get_rates(
+        self,
+        lookups: Iterable[tuple[float, str]],
+        dst: str,
+        staleness: StalenessPolicy | None = None,
+    ) -> dict[tuple[float, str], tuple[Decimal, float]]:
+        """
+        Resolves many (timestamp, src) lookups against the cache, one sweep per src
+        Call prefetch() with the same staleness first if the cache might not cover them
+        """
+        policy = staleness or self.STALENESS
+        by_src: dict[str, set[float]] = dict()
+        for timestamp, src in lookups:
+            by_src.setdefault(src, set()).add(timestamp)
+
+        now = time.time()
+        result = dict()
+        for src, timestamps in by_src.items():
+            ts_list = list(timestamps)
+            if src == dst:
+                rates = [(Decimal(1), 0)] * len(ts_list)
+            else:
+                rates = self._get_index(src, dst).closest_many(ts_list)
+
+            for ts, rate in zip(ts_list, rates):
+                if src != dst and policy.is_stale(ts, rate[1], now):
+                    msg = f"Closest {src} / {dst} sample for {datetime.utcfromtimestamp(ts)} is {rate[1] / 3600:.1f} hours off"
+                    if policy.strict:
+                        raise ValueError(msg)
+                    LOG.warning(msg)
+                result[(ts, src)] = rate
 
+        return result
+
+    def _refresh(self, src: str, dst: str, timestamp: float, now: float) -> bool:
+        """
+        Fetch whatever part of [timestamp - padding, now] the cache doesn't cover yet
+        Skipped if this instance already refreshed a range containing it, returns whether anything was fetched
+        A fetch that fails isn't remembered, so the next lookup tries again
+        """
+        start = min(timestamp, now) - self.FETCH_PADDING
+        refreshed = self._refreshed.get((src, dst))
+        if refreshed is not None and refreshed <= start:
+            return False
+
+        ranges = self._find_missing(src, dst, start, now)
+        instrument.count("gecko.cache_misses")
+        self._fetch_all(ranges)
+        self._refreshed[(src, dst)] = start
+        return bool(ranges)
+
+    def _lookup(
+        self, timestamp: float, src: str, dst: str, interpolate: bool
+    ) -> tuple[Decimal, float]:
+        if interpolate:
+            return self._get_index(src, dst).interpolate(timestamp)
         return self._get_closest_rate(timestamp, src, dst)
 
     def _get_closest_rate(
         self, timestamp: float, src: str, dst: str
     ) -> tuple[Decimal, float]:
-        data: dict = self.price_data[src][dst]["prices"]
+        index = self._get_index(src, dst)
+        return index.closest(timestamp)
+
+    def _get_index(self, src: str, dst: str) -> PriceIndex:
+        return self.PRICE_STORE.get(src, dst).index
+
+    def _find_missing(
+        self, src: str, dst: str, start: float, end: float
+    ) -> list[tuple[str, str, float, float]]:
+        coverage = self.PRICE_STORE.get(src, dst).coverage
+        gaps = _subtract_intervals((start, end), coverage)
+        return [(src, dst, gap_start, gap_end) for gap_start, gap_end in gaps]
+
+    def _fetch_all(self, ranges: list[tuple[str, str, float, float]]) -> None:
+        """Run the range requests concurrently, then merge the responses into the store, one write per pair"""
+        if not ranges:
+            return
 
-        cvt = lambda ts_str: float(ts_str) / 1000
-        closest_key = min(data.keys(), key=lambda ts: abs(timestamp - cvt(ts)))
+        responses = self.executor.map(self._fetch_range, *zip(*ranges))
 
-        return (Decimal(data[closest_key]), timestamp - cvt(closest_key))
+        by_pair: dict[tuple[str, str], list] = dict()
+        for (src, dst, start, end), resp in zip(ranges, responses):
+            by_pair.setdefault((src, dst), []).append((start, end, resp))
+
+        for (src, dst), fetched in by_pair.items():
+            coverage = self.PRICE_STORE.get(src, dst).coverage
+            samples = []
+            for start, end, resp in fetched:
+                samples += resp["prices"]
+                coverage = _merge_interval(coverage, (start, end))
+            with instrument.stage("gecko.store_merge"):
+                self.PRICE_STORE.merge(src, dst, samples, coverage)
 
     @limit(calls=1, period=7, scope="gecko")
-    def _fetch_market_chart(self, src: str, dst: str, timestamp: float) -> dict:
-        max_age_days = ceil((datetime.timestamp(datetime.utcnow()) - timestamp) / 86400)
-        ep = (
-            self.api_url
-            / "coins"
-            / src
-            / "market_chart"
-            % {"days": str(max_age_days), "vs_currency": dst}
-        )
-        LOG.info(f"Fetching price for {src} / {dst} -- {ep}")
-
-        resp = self.session.get(str(ep)).json()
-        assert "error" not in resp
-
-        self.price_data.setdefault(src, dict()).setdefault(
-            dst, dict(prices=dict(), market_caps=dict(), total_volumes=dict())
-        )
-        tgt = self.price_data[src][dst]
-        for k in tgt:
-            update = {d[0]: d[1] for d in resp[k]}
-            tgt[k].update(update)
-
-        self.PRICE_CACHE.dump(self.price_data)
-        return self.price_data[src][dst]
+    def _fetch_range(self, src: str, dst: str, start: float, end: float) -> dict:
+        ep = f"{self.api_url}/coins/{src}/market_chart/range"
+        params = {"vs_currency": dst, "from": str(int(start)), "to": str(ceil(end))}
+        LOG.info(f"Fetching price for {src} / {dst} -- {ep} {params}")
+
+        # throttling (429) is retried by the client, an error body here won't go away on retry
+        with instrument.stage("gecko.http"):
+            resp = self.http.get(ep, params=params).json()
+        if "error" in resp:
+            raise ValueError(f"Coingecko error for {src} / {dst}: {resp['error']}")
+        return resp
+
+
+def _subtract_intervals(
+    target: tuple[float, float], covered: list[list[float]]
+) -> list[tuple[float, float]]:
+    """Parts of target not overlapped by any of the (sorted, disjoint) covered intervals"""
+    gaps = []
+    cursor, end = target
+    for c_start, c_end in covered:
+        if c_end < cursor:
+            continue
+        if c_start > end:
+            break
+        if c_start > cursor:
+            gaps.append((cursor, c_start))
+        cursor = max(cursor, c_end)
+    if cursor < end:
+        gaps.append((cursor, end))
+    return gaps
+
+
+def _merge_interval(
+    covered: list[list[float]], new: tuple[float, float]
+) -> list[list[float]]:
+    """Insert new into the sorted, disjoint list of covered intervals"""
+    result = []
+    start, end = new
+    for c_start, c_end in covered:
+        if c_end < start or c_start > end:
+            result.append([c_start, c_end])
+        else:
+            start = min(start, c_start)
+            end = max(end, c_end)
+    result.append([start, end])
+    result.sort()
+    return result
@@ -1,18 +1,24 @@
 import base64
 import datetime
 import hashlib
+import heapq
 import hmac
 import logging
+import sys
+import threading
 import time
 import urllib.parse
+from array import array
 from dataclasses import dataclass
-from typing import Literal
+from typing import Iterable, Iterator, Literal
 from decimal import Decimal
 
-import requests
+from classes.fetch_executor import FetchExecutor
+from classes.http_client import HttpClient
 from classes.json_cache import JsonCache
 from classes.parser import Tsn, Value
 from config import paths, secrets
+from utils import instrument
 from utils.misc import limit, memoize
 
 LOG = logging.getLogger(__name__)
@@ -20,78 +26,209 @@ LOG = logging.getLogger(__name__)
 
 class KrakenService:
     API_URL = "https://api.kraken.com"
+    # ledger of the default account, other accounts are cached under kraken/{account}/
     HISTORY_CACHE = JsonCache(paths.CACHE_DIR / "kraken" / "history.json", default=[])
+    DEFAULT_ACCOUNT = "default"
 
-    def fetch_history(self):
-        history = [HistoryItem.from_raw(x) for x in self._fetch_history()]
-        return history
+    # max number of entries returned per Ledgers call
+    PAGE_SIZE = 50
+    # concurrent Ledgers pages, they still start at most once per @limit period
+    MAX_IN_FLIGHT = 2
 
-    def _fetch_history(self):
-        history: list = self.HISTORY_CACHE.load()
-        return history
+    # error prefixes meaning the call was throttled and can be retried once the counter decays
+    RATE_LIMIT_ERRORS = ("EAPI:Rate limit exceeded", "EService:Throttled")
 
-        end = time.time()
-        while True:
-            payload = dict(trades=True, end=end)
-            LOG.info(
-                f"fetching kraken history before {datetime.datetime.fromtimestamp(end)}"
+    def __init__(
+        self,
+        http: HttpClient | None = None,
+        account: str = DEFAULT_ACCOUNT,
+        api_key: str | None = None,
+        private_key: str | None = None,
+    ) -> None:
+        self.http = http or HttpClient(pool_size=self.MAX_IN_FLIGHT)
+        self.executor = FetchExecutor(self.MAX_IN_FLIGHT)
+
+        # last nonce sent, nonces have to increase with every call made with the key
+        self._nonce = 0
+        self._nonce_lock = threading.Lock()
+
+        self.account = account
+        self.api_key = api_key if api_key is not None else secrets.KRAKEN_API_KEY
+        self.private_key = (
+            private_key if private_key is not None else secrets.KRAKEN_PRIVATE_KEY
+        )
+
+        # every api key has its own rate limit counter
+        if account == self.DEFAULT_ACCOUNT:
+            self.limit_scope = "kraken"
+        else:
+            self.limit_scope = f"kraken.{account}"
+            self.HISTORY_CACHE = JsonCache(
+                paths.CACHE_DIR / "kraken" / account / "history.json", default=[]
             )
 
-            resp = self._post("/0/private/Ledgers", payload)
-            results = resp["result"]["ledger"]
+    @classmethod
+    def accounts(cls, http: HttpClient | None = None) -> list["KrakenService"]:
+        """
+        One service per account in secrets.KRAKEN_ACCOUNTS ({name: (api key, private key)}),
+        or just the default account if that isn't set
+        """
+        accounts = getattr(secrets, "KRAKEN_ACCOUNTS", None)
+        if not accounts:
+            return [cls(http=http)]
+        return [
+            cls(http=http, account=name, api_key=api_key, private_key=private_key)
+            for name, (api_key, private_key) in accounts.items()
+        ]
+
+    @classmethod
+    def fetch_histories(
+        cls, services: list["KrakenService"], live=False
+    ) -> list["HistoryTable"]:
+        """Each account's ledger, fetched concurrently (they don't share a rate limit)"""
+        executor = FetchExecutor(len(services))
+        return executor.map(lambda service: service.fetch_history(live=live), services)
+
+    def fetch_history(self, live=False) -> "HistoryTable":
+        rows = self._fetch_history(live=live)
+        with instrument.stage("kraken.history_table"):
+            return HistoryTable.from_raw(rows, account=self.account)
+
+    def _fetch_history(self, live=False) -> list[dict]:
+        """
+        Returns the ledger oldest-first
+        If live, first pulls whatever was added since the newest cached entry
+        """
+        # cache is stored newest-first
+        with instrument.stage("kraken.load_history"):
+            history: list = self.HISTORY_CACHE.load()
+            history.sort(key=lambda x: x["time"], reverse=True)
+        instrument.count("kraken.cached_entries", len(history))
 
-            newItems = {
-                k: v
-                for k, v in results.items()
-                if not any(k == y["id"] for y in history)
-            }
-            if not len(newItems):
-                break
+        if live:
+            with instrument.stage("kraken.fetch_new_entries"):
+                new_items = self._fetch_new_entries(history)
+            instrument.count("kraken.new_entries", len(new_items))
+            if new_items:
+                history = list(
+                    heapq.merge(
+                        new_items, history, key=lambda x: x["time"], reverse=True
+                    )
+                )
+                self.HISTORY_CACHE.dump(history)
 
-            for id, data in newItems.items():
+        return list(reversed(history))
+
+    def _fetch_new_entries(self, history: list[dict]) -> list[dict]:
+        known = {x["id"] for x in history}
+
+        # start is exclusive, back off a second so entries sharing the newest timestamp aren't skipped
+        start = history[0]["time"] - 1 if history else None
+        # pin the end so the result set (and therefore each page offset) can't shift while paging
+        end = int(time.time())
+
+        since = datetime.datetime.fromtimestamp(start) if start else "the beginning"
+        LOG.info(f"fetching kraken history for {self.account} since {since}")
+
+        first = self._fetch_ledger_page(start, end, 0)
+        count = first["count"]
+        pages = [first] + self.executor.map(
+            lambda ofs: self._fetch_ledger_page(start, end, ofs),
+            range(self.PAGE_SIZE, count, self.PAGE_SIZE),
+        )
+
+        new_items: list[dict] = []
+        for page in pages:
+            for id, data in page["ledger"].items():
+                if id in known:
+                    continue
+                known.add(id)
                 data["id"] = id
-            newItems = sorted(
-                list(newItems.values()), key=lambda trade: trade["time"], reverse=True
-            )
+                new_items.append(data)
+
+        new_items.sort(key=lambda x: x["time"], reverse=True)
+        return new_items
 
-            history += newItems
-            end = history[-1]["time"]
+    def _fetch_ledger_page(self, start: float | None, end: int, ofs: int) -> dict:
+        payload = dict(trades=True, end=end, ofs=ofs)
+        if start is not None:
+            payload["start"] = start
 
-        self.HISTORY_CACHE.dump(history)
-        history = list(reversed(history))
-        return history
+        LOG.debug(f"fetching kraken ledger page at offset {ofs}")
+        resp = self._post("/0/private/Ledgers", payload)
+        if resp.get("error"):
+            raise ValueError(f"Kraken Ledgers error: {resp['error']}")
+        return resp["result"]
 
     def _get_src_dst(self, trade: dict, pair: dict) -> tuple[Value, Value]:
         quote = pair["quote"]
         base = pair["base"]
 
         if trade["type"] == "buy":
-            src = Value(quantity=float(trade["cost"]), currency=quote)
-            dst = Value(quantity=float(trade["vol"]), currency=base)
+            src = Value(quantity=Decimal(trade["cost"]), currency=quote)
+            dst = Value(quantity=Decimal(trade["vol"]), currency=base)
         else:
-            src = Value(quantity=float(trade["vol"]), currency=base)
-            dst = Value(quantity=float(trade["cost"]), currency=quote)
+            src = Value(quantity=Decimal(trade["vol"]), currency=base)
+            dst = Value(quantity=Decimal(trade["cost"]), currency=quote)
 
         return src, dst
 
-    @memoize(paths.CACHE_DIR / "kraken" / "prices.json")
+    @memoize(paths.CACHE_DIR / "kraken" / "prices.sqlite")
     @limit(calls=1, period=2, scope="kraken")
     def _fetch_coin_price(self, id: str, date: str) -> dict:
         LOG.info(f"fetching price for {id} at {date}")
         ep = self.api_url / "coins" / id % {date: date}
         return self.session.get(str(ep)).json()
 
-    @limit(calls=1, period=5, scope="kraken")
+    @limit(calls=1, period=5, scope=lambda self, *args: self.limit_scope)
     def _post(self, path: str, data: dict):
-        data["nonce"] = str(int(time.time() * 1000))
+        """
+        Kraken rejects a reused nonce, so the client can't resend a failed request as-is
+        Failed / throttled attempts (429 / 5xx, or throttling reported in the body) are retried here instead,
+        each with a fresh nonce / signature
+        """
+        import requests
+
+        attempt = 0
+        while True:
+            data["nonce"] = self._next_nonce()
 
-        headers = {}
-        headers["API-Key"] = secrets.KRAKEN_API_KEY
-        headers["API-Sign"] = self._sign(path, data)
+            headers = {}
+            headers["API-Key"] = self.api_key
+            headers["API-Sign"] = self._sign(path, data)
 
-        resp = requests.post(self.API_URL + path, headers=headers, data=data)
-        resp = resp.json()
-        return resp
+            try:
+                with instrument.stage("kraken.http"):
+                    resp = self.http.post(
+                        self.API_URL + path, headers=headers, data=data, max_retries=0
+                    )
+                    resp = resp.json()
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as e:
+                if attempt >= self.http.max_retries:
+                    raise
+                failed = getattr(e, "response", None)
+                retry_after = None
+                if failed is not None:
+                    retry_after = failed.headers.get("Retry-After")
+                delay = self.http.delay(attempt, retry_after)
+                LOG.warning(f"kraken {path} failed ({e}), retrying in {delay:.1f}s")
+            else:
+                errors = resp.get("error") or []
+                throttled = any(e.startswith(self.RATE_LIMIT_ERRORS) for e in errors)
+                if not throttled or attempt >= self.http.max_retries:
+                    return resp
+
+                delay = self.http.delay(attempt)
+                LOG.warning(f"kraken {path} throttled ({errors}), retrying in {delay:.1f}s")
+
+            self.http.wait(delay)
+            attempt += 1
+
+    def _next_nonce(self) -> str:
+        """Millisecond timestamp, bumped past the last one so concurrent pages / quick retries don't reuse it"""
+        with self._nonce_lock:
+            self._nonce = max(int(time.time() * 1000), self._nonce + 1)
+            return str(self._nonce)
 
     def _sign(self, path: str, data):
         postdata = urllib.parse.urlencode(data)
@@ -99,13 +236,13 @@ class KrakenService:
         message = path.encode() + hashlib.sha256(encoded).digest()
 
         mac = hmac.new(
-            base64.b64decode(secrets.KRAKEN_PRIVATE_KEY), message, hashlib.sha512
+            base64.b64decode(self.private_key), message, hashlib.sha512
         )
         sigdigest = base64.b64encode(mac.digest())
         return sigdigest.decode()
 
 
-@dataclass
+@dataclass(slots=True)
 class HistoryItem:
     aclass: str
     amount: Decimal
@@ -117,6 +254,8 @@ class HistoryItem:
     type: Literal["deposit", "withdrawal", "spend", "receive", "staking"]
     subtype: str
     id: str
+    # kraken account the entry belongs to, refids are only unique within an account
+    account: str = KrakenService.DEFAULT_ACCOUNT
 
     @classmethod
     def from_raw(cls, d: dict) -> "HistoryItem":
@@ -126,12 +265,117 @@ class HistoryItem:
         d["fee"] = Decimal(d["fee"])
         return cls(**d)
 
-    def copy(self) -> "HistoryItem":
-        return HistoryItem(**self.__dict__)
+
+class HistoryTable:
+    """
+    Column-oriented ledger, sorted by time
+    Amounts are stored as integer multiples of 10^-AMOUNT_SCALE and only turned into Decimals when a row is read
+    """
+
+    # Kraken reports ledger amounts with at most 10 decimals
+    AMOUNT_SCALE = 10
+
+    def __init__(self, account=KrakenService.DEFAULT_ACCOUNT) -> None:
+        # every row belongs to the same account
+        self.account = account
+        self.id: list[str] = []
+        self.refid: list[str] = []
+        self.aclass: list[str] = []
+        self.asset: list[str] = []
+        self.type: list[str] = []
+        self.subtype: list[str] = []
+        self.time = array("d")
+        self.amount: array | list[int] = array("q")
+        self.fee: array | list[int] = array("q")
+        self.balance: array | list[int] = array("q")
+
+    @classmethod
+    def from_raw(
+        cls, rows: list[dict], account=KrakenService.DEFAULT_ACCOUNT
+    ) -> "HistoryTable":
+        """rows are the cached ledger entries, oldest first"""
+        table = cls(account=account)
+        table.id = [x["id"] for x in rows]
+        table.refid = [x["refid"] for x in rows]
+        table.aclass = [sys.intern(x["aclass"]) for x in rows]
+        table.asset = [sys.intern(x["asset"]) for x in rows]
+        table.type = [sys.intern(x["type"]) for x in rows]
+        table.subtype = [sys.intern(x["subtype"]) for x in rows]
+        table.time = array("d", (float(x["time"]) for x in rows))
+        table.amount = cls._units_column(x["amount"] for x in rows)
+        table.fee = cls._units_column(x["fee"] for x in rows)
+        table.balance = cls._units_column(x["balance"] for x in rows)
+        return table
+
+    def __len__(self) -> int:
+        return len(self.id)
+
+    def __getitem__(self, idx: int) -> HistoryItem:
+        scale = -self.AMOUNT_SCALE
+        return HistoryItem(
+            aclass=self.aclass[idx],
+            amount=Decimal(self.amount[idx]).scaleb(scale),
+            asset=self.asset[idx],
+            balance=Decimal(self.balance[idx]).scaleb(scale),
+            fee=Decimal(self.fee[idx]).scaleb(scale),
+            refid=self.refid[idx],
+            time=self.time[idx],
+            type=self.type[idx],  # type: ignore
+            subtype=self.subtype[idx],
+            id=self.id[idx],
+            account=self.account,
+        )
+
+    def __iter__(self) -> Iterator[HistoryItem]:
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def tail(self, start: int) -> "HistoryTable":
+        """Rows from index start onwards"""
+        table = HistoryTable(account=self.account)
+        for name, column in vars(self).items():
+            if name != "account":
+                setattr(table, name, column[start:])
+        return table
+
+    @classmethod
+    def _units_column(cls, values: Iterable[str]) -> array | list[int]:
+        units = [cls._to_units(x) for x in values]
+        try:
+            return array("q", units)
+        except OverflowError:
+            # too large for int64 at this scale, keep plain ints
+            return units
+
+    @classmethod
+    def _to_units(cls, text: str) -> int:
+        whole, _, frac = text.partition(".")
+        if len(frac) > cls.AMOUNT_SCALE or "e" in text.lower():
+            units = Decimal(text).scaleb(cls.AMOUNT_SCALE)
+            if units != units.to_integral_value():
+                raise ValueError(f"{text} has more than {cls.AMOUNT_SCALE} decimals")
+            return int(units)
+
+        sign = -1 if whole.startswith("-") else 1
+        whole = whole.lstrip("+-") or "0"
+        frac = frac.ljust(cls.AMOUNT_SCALE, "0")
+        return sign * (int(whole) * 10**cls.AMOUNT_SCALE + int(frac))
+
+
+
+def merge_histories(tables: list[HistoryTable]) -> Iterator[HistoryItem]:
+    """Rows of several ledgers in time order, merged lazily instead of concatenated and re-sorted"""
+    if len(tables) == 1:
+        return iter(tables[0])
+    return heapq.merge(*tables, key=lambda item: item.time)
 
 
 if __name__ == "__main__":
-    import config.configure_logging
+    from config.configure_logging import configure_logging
 
-    resp = KrakenService().fetch_transactions()
-    pass
+    configure_logging()
+    services = KrakenService.accounts()
+    for service, history in zip(
+        services, KrakenService.fetch_histories(services, live=True)
+    ):
+        LOG.info(f"{len(history)} ledger entries cached for {service.account}")
@@ -1,6 +1,64 @@
+import time
 from abc import ABCMeta, abstractmethod
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Iterable
+
+
+@dataclass(frozen=True)
+class StalenessPolicy:
+    """How far the closest sample may be from a lookup before it's refreshed / rejected"""
+
+    # max abs(time_diff) in seconds for lookups younger than recent_age
+    recent: float = 6 * 3600
+    # and for everything older, daily samples are fine there
+    historical: float = 2 * 86400
+    recent_age: float = 86400
+    # historical lookups further off than this are refetched first, defaults to historical
+    historical_refresh: float | None = None
+    # raise instead of warning when a sample is still stale after refreshing
+    strict: bool = False
+
+    def max_diff(
+        self, timestamp: float, now: float | None = None, refresh=False
+    ) -> float:
+        if now is None:
+            now = time.time()
+        if now - timestamp < self.recent_age:
+            return self.recent
+        if refresh and self.historical_refresh is not None:
+            return self.historical_refresh
+        return self.historical
+
+    def is_stale(
+        self,
+        timestamp: float,
+        time_diff: float,
+        now: float | None = None,
+        refresh=False,
+    ) -> bool:
+        """With refresh, whether the sample is worth refetching rather than whether it's unusable"""
+        return abs(time_diff) > self.max_diff(timestamp, now, refresh)
+
 
 class RateService(metaclass=ABCMeta):
     @abstractmethod
     def get_rate(self, timestamp: float, src: str, dst: str):
         pass
+
+    def prefetch(
+        self,
+        lookups: Iterable[tuple[float, str]],
+        dst: str,
+        staleness: StalenessPolicy | None = None,
+    ) -> None:
+        """Make sure the (timestamp, src) lookups can be answered without another request, if the service caches"""
+        pass
+
+    def get_rates(
+        self,
+        lookups: Iterable[tuple[float, str]],
+        dst: str,
+        staleness: StalenessPolicy | None = None,
+    ) -> dict[tuple[float, str], tuple[Decimal, float]]:
+        return {(ts, src): self.get_rate(ts, src, dst) for ts, src in set(lookups)}
@@ -0,0 +1,136 @@
+from dataclasses import dataclass, field
+import json
+import os
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+from typing import Callable, Union
+
+from classes.json_cache import JsonCache
+from utils import instrument
+
+
+@dataclass
+class SqliteCache:
+    """
+    Drop-in alternative to JsonCache that stores each top-level key (or list index) as its own row
+    dump() only rewrites the rows whose contents changed since the last load / dump
+    """
+
+    fp: Union[str, Path]
+    default: Union[Callable[[], list | dict], list | dict]
+    namespace: str = "default"
+    # imported on the first load if the namespace is still empty
+    legacy: JsonCache | None = None
+
+    # key -> serialized value, as currently stored in the db
+    _stored: dict[str, str] = field(default_factory=dict, init=False, repr=False)
+
+    def load(self) -> list | dict:
+        with instrument.stage("sqlite_cache.load"):
+            return self._load()
+
+    def _load(self) -> list | dict:
+        with closing(self._connect()) as conn:
+            kind = conn.execute(
+                "SELECT kind FROM namespaces WHERE namespace = ?", (self.namespace,)
+            ).fetchone()
+            rows = conn.execute(
+                "SELECT key, value FROM entries WHERE namespace = ? ORDER BY rowid",
+                (self.namespace,),
+            ).fetchall()
+
+        if kind is None:
+            if self.legacy is not None:
+                result = self.legacy.load()
+                self.dump(result)
+            elif callable(self.default):
+                result = self.default()
+            else:
+                result = self.default
+            return result
+
+        self._stored = {k: v for k, v in rows}
+        if kind[0] == "list":
+            rows.sort(key=lambda r: int(r[0]))
+            return [json.loads(v) for _, v in rows]
+        else:
+            return {k: json.loads(v) for k, v in rows}
+
+    def dump(self, data: Union[list, dict]):
+        with instrument.stage("sqlite_cache.dump"):
+            self._dump(data)
+
+    def _dump(self, data: Union[list, dict]):
+        if isinstance(data, list):
+            kind = "list"
+            items = {str(idx): json.dumps(v) for idx, v in enumerate(data)}
+        else:
+            kind = "dict"
+            items = {str(k): json.dumps(v) for k, v in data.items()}
+
+        changed = [
+            (self.namespace, k, v) for k, v in items.items() if self._stored.get(k) != v
+        ]
+        removed = [(self.namespace, k) for k in self._stored if k not in items]
+
+        with closing(self._connect()) as conn:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO namespaces (namespace, kind) VALUES (?, ?)",
+                    (self.namespace, kind),
+                )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO entries (namespace, key, value) VALUES (?, ?, ?)",
+                    changed,
+                )
+                conn.executemany(
+                    "DELETE FROM entries WHERE namespace = ? AND key = ?", removed
+                )
+
+        self._stored = items
+
+    def get(self, key: str, default=None):
+        """Read a single entry without loading the rest of the namespace"""
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT value FROM entries WHERE namespace = ? AND key = ?",
+                (self.namespace, key),
+            ).fetchone()
+
+        if row is None:
+            return default
+        return json.loads(row[0])
+
+    def put(self, items: dict):
+        """Insert / overwrite a batch of entries in a dict namespace"""
+        rows = {str(k): json.dumps(v) for k, v in items.items()}
+
+        with closing(self._connect()) as conn:
+            with conn:
+                conn.execute(
+                    "INSERT OR IGNORE INTO namespaces (namespace, kind) VALUES (?, 'dict')",
+                    (self.namespace,),
+                )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO entries (namespace, key, value) VALUES (?, ?, ?)",
+                    [(self.namespace, k, v) for k, v in rows.items()],
+                )
+
+        self._stored.update(rows)
+
+    def _connect(self) -> sqlite3.Connection:
+        if not isinstance(self.fp, Path):
+            self.fp = Path(self.fp)
+        os.makedirs(self.fp.parent, exist_ok=True)
+
+        conn = sqlite3.connect(self.fp)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS namespaces (namespace TEXT PRIMARY KEY, kind TEXT NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+            "PRIMARY KEY (namespace, key))"
+        )
+        return conn
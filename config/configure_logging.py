@@ -1,18 +1,20 @@
 import logging
 
 
-log = logging.getLogger()
-log.setLevel(logging.DEBUG)
+def configure_logging(level=logging.DEBUG):
+    """Called by the entry points, importing a module shouldn't touch the root logger"""
+    log = logging.getLogger()
+    log.setLevel(level)
 
-hdlr = logging.StreamHandler()
-hdlr.setLevel(logging.DEBUG)
+    hdlr = logging.StreamHandler()
+    hdlr.setLevel(level)
 
-fmtr = logging.Formatter('%(asctime)s | %(levelname)s | %(name)s | %(message)s')
+    fmtr = logging.Formatter('%(asctime)s | %(levelname)s | %(name)s | %(message)s')
 
-hdlr.setFormatter(fmtr)
-log.addHandler(hdlr)
+    hdlr.setFormatter(fmtr)
+    log.addHandler(hdlr)
 
-###
+    ###
 
-log = logging.getLogger('urllib3')
-log.setLevel(logging.INFO)
\ No newline at end of file
+    log = logging.getLogger('urllib3')
+    log.setLevel(logging.INFO)
@@ -1,25 +1,31 @@
-kraken = dict(
-    XXBT='bitcoin',
-    UNI='uniswap',
-    SC='siacoin',
-    DOT='polkadot',
-    USDC='usd-coin',
-    ZUSD='usd',
-    ADA='cardano',
-    ALGO='algorand',
-    XETH='ethereum',
-    BAL='balancer',
-    BAT='Basic Attention Token',
-    OXT='orchid-protocol',
-    ATOM='cosmos',
-    KEEP='keep-network',
-    YFI='yearn-finance',
-    MATIC='matic-network',
-    NANO='nano',
-    SOL='solana',
-    AAVE='aave',
-    XTZ='tezos',
-    FIL='filecoin',
-    OMG='omega',
-    XETC='ethereum-classic'
-)
\ No newline at end of file
+# kraken asset -> coingecko coin id
+K2G_ID_MAP = {
+    "ADA": "cardano",
+    "ALGO": "algorand",
+    "ATOM": "cosmos",
+    "ATOM.S": "cosmos",
+    "AAVE": "aave",
+    "BAL": "balancer",
+    "BAT": "basic-attention-token",
+    "BICO": "biconomy",
+    "DOT": "polkadot",
+    "FIL": "filecoin",
+    "KEEP": "keep-network",
+    "MATIC": "matic-network",
+    "NANO": "nano",
+    "OMG": "omisego",
+    "OXT": "orchid-protocol",
+    "SC": "siacoin",
+    "SCRT": "secret",
+    "SOL": "solana",
+    "SUSHI": "sushi",
+    "UNI": "uniswap",
+    "USD": "usd",
+    "USDC": "usd-coin",
+    "XETC": "ethereum-classic",
+    "XETH": "ethereum",
+    "XTZ": "tezos",
+    "XXBT": "bitcoin",
+    "XXMR": "monero",
+    "YFI": "yearn-finance",
+}
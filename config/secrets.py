@@ -0,0 +1,2 @@
+KRAKEN_API_KEY = ""
+KRAKEN_PRIVATE_KEY = ""
@@ -0,0 +1,83 @@
+import json
+import threading
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+from urllib.parse import parse_qs, urlparse
+
+
+@dataclass
+class StubRequest:
+    method: str
+    path: str
+    # query string (GET) or form body (POST), first value of each key
+    params: dict[str, str]
+    headers: dict[str, str] = field(default_factory=dict)
+
+
+# (status, json body, extra headers)
+StubResponse = tuple[int, dict, dict]
+
+
+class StubServer:
+    """
+    Local http server standing in for an api, so the services can be tested without the network
+    handler gets every request and returns the response to send, requests are also recorded in order
+    """
+
+    def __init__(self, handler: Callable[[StubRequest], StubResponse]) -> None:
+        self.handler = handler
+        self.requests: list[StubRequest] = []
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> "StubServer":
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                self._respond(url.path, parse_qs(url.query))
+
+            def do_POST(self):
+                size = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(size).decode()
+                self._respond(urlparse(self.path).path, parse_qs(body))
+
+            def _respond(self, path: str, params: dict[str, list[str]]):
+                req = StubRequest(
+                    method=self.command,
+                    path=path,
+                    params={k: v[0] for k, v in params.items()},
+                    headers=dict(self.headers),
+                )
+                stub.requests.append(req)
+                status, body, headers = stub.handler(req)
+
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
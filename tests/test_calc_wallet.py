@@ -0,0 +1,417 @@
+import tempfile
+import unittest
+from decimal import Decimal
+from pathlib import Path
+
+from benchmarks.synthetic import generate_ledger
+from classes.json_log import JsonLog
+from classes.parser.tsn import Tsn, Value
+from classes.services.kraken_service import HistoryTable
+from tools.calc_wallet import (
+    BalanceLog,
+    HistoryParser,
+    Stack,
+    Wad,
+    Wallet,
+    make_lots,
+)
+
+# decimal rounding residue the original algorithm leaves on used-up wads
+DUST = Decimal("1e-20")
+
+
+class ReferenceWallet:
+    """
+    The original lot algorithm: every pull rescans the stack from the first wad
+    and recomputes each wad's balance from its deductions
+    Wads are [total, tsn, deductions] and deductions are [quantity, tsn]
+    """
+
+    def __init__(self) -> None:
+        self.stacks: dict[str, list] = dict()
+
+    def transact(self, tsn: Tsn) -> None:
+        match tsn.meta["type"]:
+            case "trade":
+                self.pull(tsn.src_value, tsn, tsn.dst_value)
+            case "deposit" | "staking":
+                self.push(tsn.dst_value, tsn)  # type: ignore
+            case "withdrawal":
+                self.pull(tsn.src_value, tsn)
+        if tsn.fee.quantity > 0:
+            self.pull(tsn.fee, tsn)
+
+    def push(self, value: Value, tsn: Tsn) -> None:
+        self.stacks.setdefault(value.currency, []).append(
+            [value.quantity, tsn, []]
+        )
+
+    def pull(self, value, tsn: Tsn, dst: Value | None = None) -> None:
+        rem = value.quantity
+        for wad in self.stacks.setdefault(value.currency, []):
+            available = wad[0] - sum(q for q, _ in wad[2])
+            if available <= 0:
+                continue
+
+            amount = min(rem, available)
+            wad[2].append([amount, tsn])
+            if dst is not None:
+                quantity = amount * dst.quantity / tsn.src_value.quantity  # type: ignore
+                self.push(Value(quantity, dst.currency), tsn)
+
+            rem -= amount
+            if rem == 0:
+                break
+
+
+def summarize(stacks: dict[str, list]) -> dict[str, list]:
+    """Per currency, [total, tsn id, [[quantity, tsn id]]] for every wad, dust deductions dropped"""
+    return {
+        currency: [
+            [
+                total,
+                tsn.meta["id"],
+                [[q, t.meta["id"]] for q, t in deductions if q > DUST],
+            ]
+            for total, tsn, deductions in wads
+        ]
+        for currency, wads in stacks.items()
+    }
+
+
+class TestStack(unittest.TestCase):
+    def assertSameWads(self, expected: dict, actual: dict) -> None:
+        self.assertEqual(sorted(expected), sorted(actual))
+        for currency in expected:
+            exp, act = expected[currency], actual[currency]
+            self.assertEqual(len(exp), len(act), currency)
+            for exp_wad, act_wad in zip(exp, act):
+                self.assertEqual(exp_wad[1], act_wad[1])
+                self.assertAlmostEqual(exp_wad[0], act_wad[0], delta=DUST)
+                self.assertEqual(
+                    [x[1] for x in exp_wad[2]], [x[1] for x in act_wad[2]]
+                )
+                for (q_exp, _), (q_act, _) in zip(exp_wad[2], act_wad[2]):
+                    self.assertAlmostEqual(q_exp, q_act, delta=DUST)
+
+    def test_matches_original_algorithm(self):
+        history = HistoryTable.from_raw(generate_ledger(5000))
+        tsns = HistoryParser.parse_history(history)
+
+        reference = ReferenceWallet()
+        for tsn in tsns:
+            reference.transact(tsn)
+
+        wallet = Wallet.from_history(history)
+        actual = {
+            currency: [
+                [
+                    wad.total.quantity,
+                    wad.tsn,
+                    [[x.value.quantity, x.tsn] for x in wad.deductions],
+                ]
+                for wad in stack.wads
+            ]
+            for currency, stack in wallet.stacks.items()
+            if stack.wads
+        }
+        self.assertSameWads(summarize(reference.stacks), summarize(actual))
+
+    def test_used_up_wad_is_exactly_empty(self):
+        tsn = Tsn(date=0, fee=Value(Decimal(0), "ADA"), meta=dict(type="deposit"))
+        total = Value(Decimal("228.9530119719298245614035087"), "ADA")
+        wad = Wad(total=total, tsn=tsn)
+        wad.deduct(Value(Decimal("93.84327358352982456140350865"), "ADA"), tsn)
+        wad.deduct(wad.available, tsn)
+
+        self.assertEqual(wad.remaining, 0)
+
+    def test_balance_from_wads(self):
+        tsn = Tsn(date=0, fee=Value(Decimal(0), "ADA"), meta=dict(type="deposit"))
+        wads = [
+            Wad(total=Value(Decimal(2), "ADA"), tsn=tsn),
+            Wad(total=Value(Decimal(3), "ADA"), tsn=tsn),
+        ]
+        wads[0].deduct(Value(Decimal("0.5"), "ADA"), tsn)
+
+        stack = Stack("ADA", wads=wads)
+        self.assertEqual(stack.balance, Decimal("4.5"))
+
+
+class TestLotMethods(unittest.TestCase):
+    def make_stack(self, method: str, *costs: int) -> Stack:
+        """ADA stack with a 1 ADA deposit per cost, at dates 0, 1, 2, ..."""
+        fee = Value(Decimal(0), "ADA")
+        lots = make_lots(method, lambda wad: Decimal(costs[int(wad.tsn.date)]))
+        stack = Stack("ADA", lots=lots)
+        for idx in range(len(costs)):
+            stack.push(Value(Decimal(1), "ADA"), Tsn(date=idx, fee=fee))
+        return stack
+
+    def sell(self, stack: Stack, quantity: str) -> list[int]:
+        """Dates of the wads the trade deducted from, in the order it pulled them"""
+        value = Value(Decimal(quantity), "ADA")
+        tsn = Tsn(
+            date=100,
+            fee=Value(Decimal(0), "ADA"),
+            src_value=value,
+            dst_value=Value(Decimal(quantity), "USD"),
+        )
+        return [int(x.src.tsn.date) for x in stack.pull(value, tsn)]  # type: ignore
+
+    def test_pull_order(self):
+        expected = dict(
+            fifo=[0, 1, 2],
+            lifo=[3, 2, 1],
+            # ties at 5 go to the older wad
+            hifo=[1, 3, 0],
+            lofo=[2, 0, 1],
+        )
+        for method, dates in expected.items():
+            with self.subTest(method):
+                stack = self.make_stack(method, 2, 5, 1, 5)
+                self.assertEqual(self.sell(stack, "2.5"), dates)
+                self.assertEqual(stack.balance, Decimal("1.5"))
+                self.assertEqual(stack.wads[dates[-1]].remaining, Decimal("0.5"))
+
+    def test_cost_ties_go_to_older(self):
+        for method in ["hifo", "lofo"]:
+            with self.subTest(method):
+                stack = self.make_stack(method, 3, 3, 3, 3)
+                self.assertEqual(self.sell(stack, "4"), [0, 1, 2, 3])
+
+    def test_partial_wad_stays_indexed(self):
+        for method in ["fifo", "lifo", "hifo", "lofo"]:
+            with self.subTest(method):
+                stack = self.make_stack(method, 1, 2, 3)
+                first = self.sell(stack, "0.25")
+                # the rest of the same wad comes first on the next pull
+                second = self.sell(stack, "1")
+                self.assertEqual(len(first), 1)
+                self.assertEqual(second[0], first[0])
+                self.assertEqual(stack.wads[first[0]].remaining, 0)
+                self.assertIs(stack.lots.peek(), stack.wads[second[-1]])
+
+    def test_unknown_method(self):
+        with self.assertRaises(ValueError):
+            make_lots("random")
+        with self.assertRaises(ValueError):
+            make_lots("hifo")
+
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.checkpoint = JsonLog(Path(tmp.name) / "checkpoint.jsonl")
+
+        self.rows = generate_ledger(2000)
+        # cut after a single-row entry, so no trade has only one leg in the first part
+        self.cut = next(
+            idx
+            for idx in range(len(self.rows) // 2, len(self.rows))
+            if self.rows[idx - 1]["refid"][0] in "DSW"
+        )
+
+    def replay(self, rows: list[dict], **kwargs) -> tuple[Wallet, int]:
+        """Wallet and the number of transactions replayed (instead of resumed)"""
+        with self.assertLogs("tools.calc_wallet", "DEBUG") as logs:
+            wallet = Wallet.from_history(
+                HistoryTable.from_raw(rows), checkpoint=self.checkpoint, **kwargs
+            )
+        messages = [x.getMessage() for x in logs.records]
+        replayed = [x for x in messages if x.startswith("Replayed")]
+        return wallet, int(replayed[-1].split()[1])
+
+    def test_dict_round_trip(self):
+        wallet = Wallet.from_history(HistoryTable.from_raw(self.rows))
+        data = wallet.to_dict()
+        self.assertEqual(Wallet.from_dict(data).to_dict(), data)
+
+    def test_resumes_from_checkpoint(self):
+        _, first = self.replay(self.rows[: self.cut])
+        resumed, second = self.replay(self.rows)
+        self.assertGreater(first, 0)
+        self.assertEqual(first + second, len(resumed.tsns))
+
+        scratch = Wallet.from_history(HistoryTable.from_raw(self.rows))
+        self.assertEqual(resumed.to_dict(), scratch.to_dict())
+
+    def test_appends_what_was_replayed(self):
+        early = next(
+            idx
+            for idx in range(len(self.rows) // 4, self.cut)
+            if self.rows[idx - 1]["refid"][0] in "DSW"
+        )
+        for cut in [early, self.cut, len(self.rows)]:
+            self.replay(self.rows[:cut])
+        # one segment per run, each holding only what that run replayed
+        self.assertEqual(len(self.checkpoint.load()), 3)
+
+        resumed, replayed = self.replay(self.rows)
+        self.assertEqual(replayed, 0)
+        scratch = Wallet.from_history(HistoryTable.from_raw(self.rows))
+        self.assertEqual(resumed.to_dict(), scratch.to_dict())
+        for currency, stack in scratch.stacks.items():
+            self.assertEqual(
+                [x.remaining for x in resumed.stacks[currency].wads],
+                [x.remaining for x in stack.wads],
+            )
+            self.assertEqual(resumed.stacks[currency].balance, stack.balance)
+
+    def test_delta_round_trip(self):
+        history = HistoryTable.from_raw(self.rows[: self.cut])
+        wallet = Wallet.from_history(history)
+        first = wallet.to_dict()
+
+        marks = wallet.marks()
+        for tsn in HistoryParser.parse_history(HistoryTable.from_raw(self.rows)):
+            if tsn.date > wallet.tsns[-1].date:
+                wallet.transact(tsn)
+        second = wallet.to_dict(since=marks)
+
+        self.assertLess(len(second["tsns"]["date"]), len(wallet.tsns))
+        self.assertEqual(Wallet.from_dict([first, second]).to_dict(), wallet.to_dict())
+
+    def test_resumes_cost_lots(self):
+        # any cost that only depends on the wad, so resumed wads sort the same
+        def cost(wad: Wad) -> Decimal:
+            return Decimal(int(wad.tsn.date) % 97)
+
+        self.replay(self.rows[: self.cut], method="hifo", cost=cost)
+        resumed, replayed = self.replay(self.rows, method="hifo", cost=cost)
+        self.assertLess(replayed, len(resumed.tsns))
+
+        scratch = Wallet.from_history(
+            HistoryTable.from_raw(self.rows), method="hifo", cost=cost
+        )
+        self.assertEqual(resumed.to_dict(), scratch.to_dict())
+        # and the cost actually changed which lots were used
+        fifo = Wallet.from_history(HistoryTable.from_raw(self.rows))
+        self.assertNotEqual(scratch.to_dict(), fifo.to_dict())
+
+    def test_other_method_replays_from_scratch(self):
+        self.replay(self.rows[: self.cut])
+
+        wallet, replayed = self.replay(self.rows[: self.cut], method="lifo")
+        self.assertEqual(replayed, len(wallet.tsns))
+        self.assertEqual(len(self.checkpoint.load()), 1)
+
+    def test_changed_ledger_replays_from_scratch(self):
+        self.replay(self.rows[: self.cut])
+
+        # a late-synced entry from before the checkpoint
+        late = dict(self.rows[0], refid="D-late", id="L-late")
+        late["time"] += 1
+        rows = [self.rows[0], late] + self.rows[1:]
+        wallet, replayed = self.replay(rows)
+        self.assertEqual(replayed, len(wallet.tsns))
+
+
+class TestAccounts(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.checkpoint = JsonLog(Path(tmp.name) / "checkpoint.jsonl")
+
+        # both legs of a trade share their refid, so they land in the same account
+        self.rows = generate_ledger(2000)
+        self.accounts = {
+            name: [x for x in self.rows if int(x["refid"][1:]) % 2 == parity]
+            for parity, name in enumerate(["main", "other"])
+        }
+
+    def tables(self, until: float | None = None) -> list[HistoryTable]:
+        return [
+            HistoryTable.from_raw(
+                [x for x in rows if until is None or x["time"] <= until],
+                account=account,
+            )
+            for account, rows in self.accounts.items()
+        ]
+
+    def assertSameReplay(self, wallet: Wallet, expected: Wallet):
+        self.assertEqual(
+            [(x.date, x.meta["id"]) for x in wallet.tsns],
+            [(x.date, x.meta["id"]) for x in expected.tsns],
+        )
+        self.assertEqual(
+            {k: v.balance for k, v in wallet.stacks.items()},
+            {k: v.balance for k, v in expected.stacks.items()},
+        )
+
+    def test_matches_single_ledger(self):
+        single = Wallet.from_history(HistoryTable.from_raw(self.rows))
+        merged = Wallet.from_history(self.tables())
+
+        self.assertSameReplay(merged, single)
+        self.assertEqual(
+            {x.meta["account"] for x in merged.tsns}, {"main", "other"}
+        )
+        for tsn in merged.tsns:
+            parity = int(tsn.meta["id"][1:]) % 2
+            self.assertEqual(tsn.meta["account"], ["main", "other"][parity])
+
+    def test_resumes_from_checkpoint(self):
+        cut = self.rows[len(self.rows) // 2]["time"]
+        first = Wallet.from_history(self.tables(cut), checkpoint=self.checkpoint)
+        with self.assertLogs("tools.calc_wallet", "DEBUG") as logs:
+            resumed = Wallet.from_history(self.tables(), checkpoint=self.checkpoint)
+        self.assertIn(
+            f"Replayed {len(resumed.tsns) - len(first.tsns)} new transactions",
+            [x.getMessage() for x in logs.records],
+        )
+
+        scratch = Wallet.from_history(self.tables())
+        self.assertSameReplay(resumed, scratch)
+        self.assertEqual(resumed.to_dict(), scratch.to_dict())
+
+
+class TestBalanceLog(unittest.TestCase):
+    def test_balance_at(self):
+        log = BalanceLog()
+        log.record("ADA", 100, Decimal(5))
+        log.record("ADA", 200, Decimal(3))
+        # a second event at the same time replaces the first
+        log.record("ADA", 200, Decimal(4))
+
+        self.assertEqual(log.balance_at("ADA", 99), 0)
+        self.assertEqual(log.balance_at("ADA", 100), 5)
+        self.assertEqual(log.balance_at("ADA", 199.9), 5)
+        self.assertEqual(log.balance_at("ADA", 200), 4)
+        self.assertEqual(log.balance_at("ADA", 10**10), 4)
+        self.assertEqual(log.balance_at("DOT", 200), 0)
+
+    def test_out_of_order(self):
+        log = BalanceLog()
+        log.record("ADA", 200, Decimal(5))
+        with self.assertRaises(ValueError):
+            log.record("ADA", 100, Decimal(3))
+
+    def test_matches_partial_replay(self):
+        history = HistoryTable.from_raw(generate_ledger(1000))
+        wallet = Wallet.from_history(history)
+        tsns = wallet.tsns
+
+        for idx in [0, 10, len(tsns) // 2, len(tsns) - 1]:
+            time = tsns[idx].date
+            partial = Wallet()
+            for tsn in tsns:
+                if tsn.date <= time:
+                    partial.transact(tsn)
+
+            expected = {
+                currency: stack.balance for currency, stack in partial.stacks.items()
+            }
+            actual = {
+                currency: value.quantity
+                for currency, value in wallet.balances_at(time).items()
+                if currency in expected
+            }
+            self.assertEqual(actual, expected)
+            for currency, balance in expected.items():
+                self.assertEqual(wallet.balance_at(currency, time).quantity, balance)
+
+
+if __name__ == "__main__":
+    unittest.main()
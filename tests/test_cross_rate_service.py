@@ -0,0 +1,110 @@
+import unittest
+from decimal import Decimal
+
+from classes.services.cross_rate_service import CrossRateService, _worst
+from classes.services.rate_service import RateService
+
+# usd price and time_diff of each coin's closest sample
+PRICES = {
+    "bitcoin": (Decimal(40000), 600),
+    "ethereum": (Decimal(2500), -1800),
+    "cardano": (Decimal("0.5"), 60),
+}
+
+
+class StubBase(RateService):
+    """usd series only, records what's asked of it"""
+
+    def __init__(self) -> None:
+        self.calls: list[tuple] = []
+        self.prefetched: list[tuple[set, str]] = []
+
+    def get_rate(self, timestamp: float, src: str, dst: str, live=False, **kwargs):
+        assert dst == "usd", dst
+        self.calls.append((timestamp, src, dst, kwargs))
+        return PRICES[src]
+
+    def prefetch(self, lookups, dst, staleness=None):
+        self.prefetched.append((set(lookups), dst))
+
+
+class TestCrossRateService(unittest.TestCase):
+    def setUp(self):
+        self.base = StubBase()
+        self.rates = CrossRateService(self.base, quote="usd")
+
+    def test_get_rate_and_get_rates_agree(self):
+        lookups = [
+            (ts, src)
+            for ts in [100.0, 200.0]
+            for src in ["bitcoin", "ethereum", "cardano", "usd"]
+        ]
+        for dst in ["usd", "ethereum", "cardano"]:
+            with self.subTest(dst):
+                batch = self.rates.get_rates(lookups, dst)
+                self.assertEqual(set(batch), set(lookups))
+                for ts, src in lookups:
+                    self.assertEqual(
+                        batch[(ts, src)], self.rates.get_rate(ts, src, dst)
+                    )
+
+    def test_cross_rate_reports_worst_time_diff(self):
+        rate, time_diff = self.rates.get_rate(100, "bitcoin", "ethereum")
+        self.assertEqual(rate, 16)
+        self.assertEqual(time_diff, -1800)
+
+        rate, time_diff = self.rates.get_rate(100, "cardano", "bitcoin")
+        self.assertEqual(rate, Decimal("0.5") / 40000)
+        self.assertEqual(time_diff, 600)
+
+        self.assertEqual(_worst(600, -1800), -1800)
+        self.assertEqual(_worst(-60, 60), -60)
+
+    def test_short_circuits(self):
+        self.assertEqual(self.rates.get_rate(100, "bitcoin", "bitcoin"), (1, 0))
+        self.assertEqual(self.base.calls, [])
+
+        # only the src leg is looked up when dst is the quote
+        self.assertEqual(self.rates.get_rate(100, "bitcoin", "usd"), PRICES["bitcoin"])
+        self.assertEqual(self.base.calls, [(100, "bitcoin", "usd", {})])
+
+        rate, _ = self.rates.get_rate(100, "usd", "cardano")
+        self.assertEqual(rate, 2)
+        self.assertEqual(len(self.base.calls), 2)
+
+    def test_kwargs_reach_both_legs(self):
+        self.rates.get_rate(100, "bitcoin", "ethereum", interpolate=True)
+        self.assertEqual(
+            [(src, kwargs) for _, src, _, kwargs in self.base.calls],
+            [("bitcoin", dict(interpolate=True)), ("ethereum", dict(interpolate=True))],
+        )
+
+    def test_prefetch_asks_for_quote_legs(self):
+        lookups = [(100, "bitcoin"), (100, "usd"), (200, "ethereum"), (300, "cardano")]
+        self.rates.prefetch(lookups, "cardano")
+
+        # both legs against usd, nothing for usd itself or the cardano / cardano lookup
+        self.assertEqual(
+            self.base.prefetched,
+            [
+                (
+                    {
+                        (100, "bitcoin"),
+                        (100, "cardano"),
+                        (200, "ethereum"),
+                        (200, "cardano"),
+                    },
+                    "usd",
+                )
+            ],
+        )
+
+        self.rates.prefetch(lookups, "usd")
+        self.assertEqual(
+            self.base.prefetched[-1],
+            ({(100, "bitcoin"), (200, "ethereum"), (300, "cardano")}, "usd"),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,173 @@
+import unittest
+from array import array
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from benchmarks.synthetic import generate_ledger
+from classes.parser.tsn import Tsn, Value
+from classes.services.kraken_service import HistoryTable
+from classes.services.rate_service import RateService
+from config.gecko_currency_map import K2G_ID_MAP
+from tools.calc_wallet import Wallet
+from tools.gains_engine import GainsTable, compute_gains, _years
+
+# within Decimal's 28 digits, the two loops only differ in summation order
+EPSILON = Decimal("1e-12")
+
+
+class StubRates(RateService):
+    """Deterministic made up prices, counts the calls so batching can be checked"""
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.batches = 0
+
+    def get_rate(self, timestamp: float, src: str, dst: str, **kwargs):
+        self.calls += 1
+        if src == dst:
+            return (Decimal(1), 0)
+        price = Decimal(len(src)) + Decimal(int(timestamp) % 10007) / 100
+        return (price, 0)
+
+    def get_rates(self, lookups, dst, staleness=None):
+        self.batches += 1
+        return super().get_rates(lookups, dst, staleness)
+
+
+class ReferenceGains:
+    """
+    The original gains report: every deduction, staking reward and open lot priced one get_rate() at a time
+    Also totals the gain per wad, which the report didn't have
+    """
+
+    def __init__(self, wallet: Wallet, rates: RateService, now: float) -> None:
+        self.realized: dict[int, Decimal] = dict()
+        self.staking: dict[int, Decimal] = dict()
+        self.unrealized: dict[str, list[Decimal]] = dict()
+        self.lots: dict[int, Decimal] = dict()
+
+        def usd(value: Value, timestamp: float) -> Decimal:
+            rate, _ = rates.get_rate(timestamp, K2G_ID_MAP[value.currency], "usd")
+            return value.quantity * rate
+
+        def year(timestamp: float) -> int:
+            return datetime.fromtimestamp(timestamp, tz=timezone.utc).year
+
+        wads = [wad for stack in wallet.stacks.values() for wad in stack.wads]
+        for wad in wads:
+            for ddt in wad.deductions:
+                if ddt.dst:
+                    gain = usd(ddt.dst.total, ddt.dst.tsn.date) - usd(
+                        ddt.value, ddt.src.tsn.date
+                    )
+                    self._add(self.realized, year(ddt.dst.tsn.date), gain)
+                    self._add(self.lots, id(wad), gain)
+
+            if wad.tsn.meta.get("type") == "staking":
+                gain = usd(wad.total, wad.tsn.date)
+                self._add(self.staking, year(wad.tsn.date), gain)
+                self._add(self.lots, id(wad), gain)
+
+            if wad.remaining > 0:
+                original = usd(wad.available, wad.tsn.date)
+                current = usd(wad.available, now)
+                totals = self.unrealized.setdefault(
+                    wad.total.currency, [Decimal(0), Decimal(0)]
+                )
+                totals[0] += original
+                totals[1] += current
+                self._add(self.lots, id(wad), current - original)
+
+    @staticmethod
+    def _add(totals: dict, key, amount: Decimal) -> None:
+        totals[key] = totals.get(key, Decimal(0)) + amount
+
+
+def tsn(date: float, kind: str, src=None, dst=None) -> Tsn:
+    return Tsn(
+        date=date,
+        fee=Value(Decimal(0), "USD"),
+        src_value=Value(Decimal(src[0]), src[1]) if src else None,
+        dst_value=Value(Decimal(dst[0]), dst[1]) if dst else None,
+        meta=dict(type=kind),
+    )
+
+
+class TestGainsEngine(unittest.TestCase):
+    def assertTotals(self, actual: dict, expected: dict):
+        self.assertEqual(sorted(actual), sorted(expected))
+        for key, total in expected.items():
+            if isinstance(total, list):
+                for act, exp in zip(actual[key], total):
+                    self.assertAlmostEqual(act, exp, delta=EPSILON)
+            else:
+                self.assertAlmostEqual(actual[key], total, delta=EPSILON)
+
+    def test_matches_per_deduction_loop(self):
+        wallet = Wallet.from_history(HistoryTable.from_raw(generate_ledger(3000)))
+        now = wallet.tsns[-1].date + 86400
+        rates = StubRates()
+
+        report = compute_gains(wallet, rates, K2G_ID_MAP, now=now)
+        self.assertEqual(rates.batches, 1)
+        lookups = rates.calls
+
+        reference = ReferenceGains(wallet, rates, now)
+        self.assertLess(lookups, rates.calls - lookups)
+        self.assertGreater(len(reference.staking), 0)
+        self.assertGreater(len(reference.unrealized), 1)
+
+        self.assertTotals(report.realized, reference.realized)
+        self.assertTotals(report.staking, reference.staking)
+        self.assertTotals(report.unrealized, reference.unrealized)
+        self.assertTotals(
+            {key: gain for key, (_, gain) in report.lots.items()}, reference.lots
+        )
+
+    def test_rows_at_new_year(self):
+        new_year = datetime(2022, 1, 1, tzinfo=timezone.utc).timestamp()
+        wallet = Wallet()
+        wallet.transact(tsn(new_year - 86400, "deposit", dst=("3", "USD")))
+        wallet.transact(tsn(new_year - 1, "trade", src=("1", "USD"), dst=("1", "ADA")))
+        wallet.transact(tsn(new_year, "trade", src=("1", "USD"), dst=("1", "DOT")))
+        wallet.transact(tsn(new_year, "staking", dst=("1", "ADA")))
+
+        table = GainsTable.from_wallet(wallet, now=new_year + 86400)
+        self.assertEqual(
+            sorted(zip(table.kind, table.currency)),
+            [
+                ("realized", "ADA"),
+                ("realized", "DOT"),
+                ("staking", "ADA"),
+                ("unrealized", "ADA"),
+                ("unrealized", "ADA"),
+                ("unrealized", "DOT"),
+                ("unrealized", "USD"),
+            ],
+        )
+
+        report = compute_gains(wallet, StubRates(), K2G_ID_MAP, now=new_year + 86400)
+        self.assertEqual(sorted(report.realized), [2021, 2022])
+        self.assertEqual(list(report.staking), [2022])
+        self.assertEqual(list(report.with_staking), [2021, 2022])
+        # a usd lot bought with usd gains nothing
+        self.assertEqual(report.unrealized["USD"][0], report.unrealized["USD"][1])
+
+    def test_years(self):
+        self.assertEqual(_years(array("d")), [])
+
+        times = []
+        for year in [2019, 2020, 2021, 2024]:
+            boundary = datetime(year, 1, 1, tzinfo=timezone.utc).timestamp()
+            times += [boundary - 1, boundary, boundary + 1]
+        times += [datetime(2022, 6, 1, tzinfo=timezone.utc).timestamp()]
+
+        expected = [
+            datetime.fromtimestamp(ts, tz=timezone.utc).year for ts in times
+        ]
+        self.assertEqual(_years(array("d", times)), expected)
+        self.assertEqual(_years(array("d", times[:1])), [2018])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from classes.price_store import PriceStore
+from classes.rate_limiter import RateLimiter
+from classes.services.gecko_service import GeckoService
+from classes.services.rate_service import StalenessPolicy
+from tests.stub_server import StubRequest, StubServer
+
+DAY = 86400
+
+
+def hourly_prices(req: StubRequest) -> tuple[int, dict, dict]:
+    """market_chart/range answer with one sample per hour, priced by the hour's index"""
+    start, end = int(req.params["from"]), int(req.params["to"])
+    hours = range(start - start % 3600, end, 3600)
+    prices = [[ts * 1000, ts // 3600] for ts in hours]
+    return 200, dict(prices=prices, market_caps=[], total_volumes=[]), {}
+
+
+class TestGeckoService(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.store = PriceStore(Path(tmp.name) / "prices")
+
+        # the real limits allow one request every few seconds
+        patcher = mock.patch.object(RateLimiter, "acquire", return_value=0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.now = time.time()
+
+    def make_service(self, server: StubServer) -> GeckoService:
+        gecko = GeckoService(api_url=server.url)
+        gecko.PRICE_STORE = self.store  # type: ignore
+        return gecko
+
+    def test_fetches_only_missing_ranges(self):
+        with StubServer(hourly_prices) as server:
+            gecko = self.make_service(server)
+            old, older = self.now - 30 * DAY, self.now - 40 * DAY
+
+            gecko.prefetch([(old, "bitcoin")], "usd")
+            self.assertEqual(len(server.requests), 1)
+            first = server.requests[0]
+            self.assertEqual(first.path, "/coins/bitcoin/market_chart/range")
+            self.assertEqual(first.params["vs_currency"], "usd")
+
+            # already covered, answered from the store
+            gecko.prefetch([(old + 3600, "bitcoin")], "usd")
+            self.assertEqual(len(server.requests), 1)
+
+            # only the part before the first range is requested
+            gecko.prefetch([(older, "bitcoin")], "usd")
+            self.assertEqual(len(server.requests), 2)
+            second = server.requests[1]
+            self.assertLessEqual(
+                int(second.params["to"]), int(first.params["from"]) + 1
+            )
+
+            rate, time_diff = gecko.get_rate(older, "bitcoin", "usd")
+            self.assertEqual(len(server.requests), 2)
+            self.assertLessEqual(abs(time_diff), 1800)
+            self.assertEqual(rate, int(older - time_diff) // 3600)
+
+    def test_failed_fetch_is_retried(self):
+        responses = [(200, dict(error="coin not found"), {})]
+
+        def handler(req: StubRequest):
+            return responses.pop() if responses else hourly_prices(req)
+
+        with StubServer(handler) as server:
+            gecko = self.make_service(server)
+            lookup = (self.now - 30 * DAY, "bitcoin")
+
+            with self.assertRaises(ValueError):
+                gecko.prefetch([lookup], "usd")
+            self.assertFalse(self.store.has("bitcoin", "usd"))
+
+            gecko.prefetch([lookup], "usd")
+            self.assertEqual(len(server.requests), 2)
+            self.assertTrue(self.store.has("bitcoin", "usd"))
+
+    def test_failed_refresh_is_retried(self):
+        responses = [(200, dict(error="coin not found"), {})]
+
+        def handler(req: StubRequest):
+            return responses.pop() if responses else hourly_prices(req)
+
+        with StubServer(handler) as server:
+            gecko = self.make_service(server)
+            timestamp = self.now - 30 * DAY
+
+            with self.assertRaises(ValueError):
+                gecko.get_rate(timestamp, "bitcoin", "usd")
+            _, time_diff = gecko.get_rate(timestamp, "bitcoin", "usd")
+            self.assertEqual(len(server.requests), 2)
+            self.assertLessEqual(abs(time_diff), 1800)
+
+    def test_historical_refresh_threshold(self):
+        timestamp = self.now - 30 * DAY
+        # a single sample 1.5 days before the lookup, with nothing fetched after it
+        sample = timestamp - 1.5 * DAY
+        self.store.merge(
+            "bitcoin", "usd", [[sample * 1000, 1]], [[sample - 60, sample + 60]]
+        )
+
+        with StubServer(hourly_prices) as server:
+            gecko = self.make_service(server)
+
+            # close enough for the default policy
+            self.assertEqual(gecko.get_rate(timestamp, "bitcoin", "usd")[0], 1)
+            self.assertEqual(len(server.requests), 0)
+
+            policy = StalenessPolicy(historical_refresh=DAY)
+            _, time_diff = gecko.get_rate(
+                timestamp, "bitcoin", "usd", staleness=policy
+            )
+            self.assertEqual(len(server.requests), 1)
+            self.assertLessEqual(abs(time_diff), 1800)
+
+    def test_batched_lookups_follow_the_policy(self):
+        timestamp = self.now - 30 * DAY
+        sample = timestamp - 1.5 * DAY
+        self.store.merge(
+            "bitcoin", "usd", [[sample * 1000, 1]], [[sample - 60, sample + 60]]
+        )
+        lookups = [(timestamp, "bitcoin")]
+        strict = StalenessPolicy(historical=DAY, strict=True)
+
+        # 1.5 days off is fine by default, the strict policy refetches and then rejects it
+        with StubServer(hourly_prices) as server:
+            gecko = self.make_service(server)
+            gecko.prefetch(lookups, "usd")
+            self.assertEqual(len(server.requests), 0)
+            with self.assertRaises(ValueError):
+                gecko.get_rates(lookups, "usd", staleness=strict)
+
+            gecko.prefetch(lookups, "usd", staleness=strict)
+            self.assertEqual(len(server.requests), 1)
+            rates = gecko.get_rates(lookups, "usd", staleness=strict)
+            self.assertLessEqual(abs(rates[lookups[0]][1]), 1800)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+from decimal import Decimal
+
+from classes.services.kraken_service import HistoryItem
+from tools.calc_wallet import HistoryParser
+
+
+def item(type: str, asset: str, amount: str, refid: str, time: float, **kwargs):
+    return HistoryItem.from_raw(
+        dict(
+            aclass="currency",
+            amount=amount,
+            asset=asset,
+            balance="0",
+            fee=kwargs.pop("fee", "0"),
+            refid=refid,
+            time=time,
+            type=type,
+            subtype="",
+            id=f"L{refid}{amount}",
+            **kwargs,
+        )
+    )
+
+
+class TestHistoryParser(unittest.TestCase):
+    def test_pairs_legs_that_arent_adjacent(self):
+        history = [
+            item("trade", "ZUSD", "-100", "T1", 1000),
+            item("deposit", "XETH", "2", "D1", 1001),
+            item("trade", "XXBT", "0.01", "T1", 1002),
+        ]
+
+        tsns = HistoryParser.parse_history(history)
+        self.assertEqual([x.meta["type"] for x in tsns], ["trade", "deposit"])
+
+        trade = tsns[0]
+        self.assertEqual(trade.date, 1000)
+        self.assertEqual(trade.src_value.currency, "USD")  # type: ignore
+        self.assertEqual(trade.src_value.quantity, Decimal(100))  # type: ignore
+        self.assertEqual(trade.dst_value.currency, "XXBT")  # type: ignore
+        self.assertEqual(trade.dst_value.quantity, Decimal("0.01"))  # type: ignore
+
+    def test_legs_outside_the_window_are_skipped(self):
+        window = HistoryParser.PAIR_WINDOW
+        history = [
+            item("trade", "ZUSD", "-100", "T1", 1000),
+            item("deposit", "XETH", "2", "D1", 1000 + window),
+            item("trade", "XXBT", "0.01", "T1", 1001 + window),
+        ]
+
+        with self.assertLogs("tools.calc_wallet", "WARNING") as logs:
+            tsns = HistoryParser.parse_history(history)
+        self.assertEqual([x.meta["id"] for x in tsns], ["D1"])
+        self.assertEqual(len(logs.records), 2)
+
+    def test_legs_at_the_window_edge_are_paired(self):
+        window = HistoryParser.PAIR_WINDOW
+        history = [
+            item("spend", "ZUSD", "-100", "T1", 1000),
+            item("receive", "XXBT", "0.01", "T1", 1000 + window),
+        ]
+
+        tsns = HistoryParser.parse_history(history)
+        self.assertEqual([x.meta["type"] for x in tsns], ["trade"])
+
+    def test_refids_are_paired_per_account(self):
+        history = [
+            item("trade", "ZUSD", "-100", "T1", 1000, account="a"),
+            item("trade", "XXBT", "0.01", "T1", 1001, account="b"),
+        ]
+
+        with self.assertLogs("tools.calc_wallet", "WARNING"):
+            tsns = HistoryParser.parse_history(history)
+        self.assertEqual(tsns, [])
+
+    def test_streams_in_time_order(self):
+        history = [
+            item("deposit", "ZUSD", "100", "D1", 1000),
+            item("trade", "ZUSD", "-50", "T1", 1001),
+            item("staking", "DOT", "1", "S1", 1002),
+            item("trade", "XXBT", "0.01", "T1", 1003),
+            item("deposit", "ZUSD", "10", "D2", 1004),
+        ]
+
+        # a generator isn't sorted first, so it exercises the streaming path
+        tsns = list(HistoryParser.iter_history(x for x in history))
+        self.assertEqual([x.meta["id"] for x in tsns], ["D1", "T1", "S1", "D2"])
+        self.assertEqual(tsns, HistoryParser.parse_history(history))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import time
+import unittest
+from email.utils import formatdate
+
+import requests
+
+from classes.http_client import HttpClient, _parse_retry_after
+from tests.stub_server import StubRequest, StubServer
+
+
+class RecordingClient(HttpClient):
+    """Records the backoff instead of sleeping through it"""
+
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.waits: list[float] = []
+
+    def wait(self, seconds: float) -> None:
+        self.waits.append(seconds)
+
+
+def failing(*statuses: int, headers: dict | None = None):
+    """Handler answering with each status in turn, then 200"""
+    remaining = list(statuses)
+
+    def handler(req: StubRequest):
+        if remaining:
+            return remaining.pop(0), dict(error="nope"), headers or {}
+        return 200, dict(ok=True), {}
+
+    return handler
+
+
+class TestHttpClient(unittest.TestCase):
+    def test_retries_429_with_retry_after(self):
+        with StubServer(failing(429, 429, headers={"Retry-After": "7"})) as server:
+            client = RecordingClient(backoff=1)
+            resp = client.get(server.url + "/x")
+
+        self.assertEqual(resp.json(), dict(ok=True))
+        self.assertEqual(len(server.requests), 3)
+        self.assertEqual(client.waits, [7, 7])
+
+    def test_retries_5xx_with_backoff(self):
+        with StubServer(failing(500, 503, 502)) as server:
+            client = RecordingClient(backoff=1)
+            resp = client.get(server.url + "/x")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(client.waits, [1, 2, 4])
+
+    def test_gives_up_after_max_retries(self):
+        with StubServer(failing(503, 503, 503)) as server:
+            client = RecordingClient(max_retries=2)
+            with self.assertRaises(requests.HTTPError):
+                client.get(server.url + "/x")
+
+        self.assertEqual(len(server.requests), 3)
+
+    def test_no_retries(self):
+        with StubServer(failing(503)) as server:
+            client = RecordingClient()
+            with self.assertRaises(requests.HTTPError):
+                client.post(server.url + "/x", data=dict(a=1), max_retries=0)
+
+        self.assertEqual(len(server.requests), 1)
+        self.assertEqual(client.waits, [])
+
+    def test_other_errors_are_returned(self):
+        with StubServer(failing(404)) as server:
+            resp = RecordingClient().get(server.url + "/x")
+
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(len(server.requests), 1)
+
+    def test_delay(self):
+        client = HttpClient(backoff=1, max_backoff=10)
+        self.assertEqual([client.delay(x) for x in range(5)], [1, 2, 4, 8, 10])
+        self.assertEqual(client.delay(0, "30"), 10)
+        self.assertEqual(client.delay(2, "garbage"), 4)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(_parse_retry_after("5"), 5)
+        self.assertEqual(_parse_retry_after("-5"), 0)
+        self.assertIsNone(_parse_retry_after("soon"))
+
+        date = formatdate(time.time() + 60, usegmt=True)
+        self.assertAlmostEqual(_parse_retry_after(date), 60, delta=2)  # type: ignore
+
+
+if __name__ == "__main__":
+    unittest.main()
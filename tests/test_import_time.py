@@ -0,0 +1,18 @@
+import contextlib
+import io
+import unittest
+
+from tools.check_import_time import BUDGETS, check
+
+
+class TestImportTime(unittest.TestCase):
+    def test_entry_points(self):
+        """Every entry point stays within its budget and imports LAZY_MODULES lazily"""
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            ok = check(list(BUDGETS))
+        self.assertTrue(ok, "\n" + out.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
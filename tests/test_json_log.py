@@ -0,0 +1,53 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from classes.json_log import JsonLog
+
+
+class TestJsonLog(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = Path(tmp.name) / "log" / "entries.jsonl"
+        self.log = JsonLog(self.path)
+
+    def test_empty(self):
+        self.assertEqual(self.log.load(), [])
+        self.assertEqual(self.log.header(), {})
+
+    def test_append(self):
+        self.log.append(dict(a=1), header=dict(count=1))
+        self.log.append([2, 3], header=dict(count=2))
+
+        log = JsonLog(self.path)
+        self.assertEqual(log.load(), [dict(a=1), [2, 3]])
+        self.assertEqual(log.header(), dict(count=2))
+
+    def test_dump_replaces(self):
+        self.log.append(dict(a=1), header=dict(count=1))
+        self.log.dump([dict(b=2)], header=dict(count=1, fresh=True))
+        self.log.append(dict(c=3), header=dict(count=2))
+
+        self.assertEqual(self.log.load(), [dict(b=2), dict(c=3)])
+        self.assertEqual(self.log.header(), dict(count=2))
+
+    def test_unfinished_append_is_dropped(self):
+        self.log.append(dict(a=1), header=dict(count=1))
+        # as left by a crash before the header was swapped in
+        with open(self.path, "ab") as file:
+            file.write(b'{"b": [1, 2')
+
+        self.assertEqual(self.log.load(), [dict(a=1)])
+        self.log.append(dict(c=3), header=dict(count=2))
+        self.assertEqual(self.log.load(), [dict(a=1), dict(c=3)])
+
+    def test_truncated_log_is_empty(self):
+        self.log.append(dict(a=1), header=dict(count=1))
+        self.path.write_bytes(b"")
+
+        self.assertEqual(self.log.load(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+import base64
+import unittest
+from unittest import mock
+
+from classes.rate_limiter import RateLimiter
+from classes.services.kraken_service import (
+    HistoryTable,
+    KrakenService,
+    merge_histories,
+)
+from tests.stub_server import StubRequest, StubServer
+from tests.test_http_client import RecordingClient
+
+
+def ledger_page(req: StubRequest):
+    ofs = int(req.params["ofs"])
+    ledger = {
+        f"L{idx}": dict(
+            aclass="currency",
+            amount="1.0",
+            asset="ZUSD",
+            balance="1",
+            fee="0",
+            refid=f"D{idx}",
+            time=1.6e9 + idx,
+            type="deposit",
+            subtype="",
+        )
+        for idx in range(ofs, min(ofs + KrakenService.PAGE_SIZE, 120))
+    }
+    return 200, dict(error=[], result=dict(ledger=ledger, count=120)), {}
+
+
+class TestKrakenService(unittest.TestCase):
+    def setUp(self):
+        # the real limits allow one call every few seconds
+        patcher = mock.patch.object(RateLimiter, "acquire", return_value=0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_service(self, server: StubServer) -> KrakenService:
+        service = KrakenService(
+            http=RecordingClient(),
+            api_key="key",
+            private_key=base64.b64encode(b"secret").decode(),
+        )
+        service.API_URL = server.url
+        return service
+
+    def test_failed_posts_are_signed_again(self):
+        responses = [
+            (503, dict(), {}),
+            (429, dict(), {"Retry-After": "3"}),
+            (200, dict(error=["EAPI:Rate limit exceeded"]), {}),
+        ]
+
+        def handler(req: StubRequest):
+            return responses.pop(0) if responses else ledger_page(req)
+
+        with StubServer(handler) as server:
+            service = self.make_service(server)
+            page = service._fetch_ledger_page(None, 1700000000, 0)
+
+        self.assertEqual(len(page["ledger"]), KrakenService.PAGE_SIZE)
+        self.assertEqual(len(server.requests), 4)
+        self.assertEqual(service.http.waits, [1, 3, 4])  # type: ignore
+
+        nonces = [x.params["nonce"] for x in server.requests]
+        signatures = [x.headers["API-Sign"] for x in server.requests]
+        self.assertEqual(len(set(nonces)), 4)
+        self.assertEqual(len(set(signatures)), 4)
+        self.assertEqual(nonces, sorted(nonces, key=int))
+
+    def test_error_body_raises(self):
+        def handler(req: StubRequest):
+            return 200, dict(error=["EAPI:Invalid nonce"]), {}
+
+        with StubServer(handler) as server:
+            service = self.make_service(server)
+            with self.assertRaises(ValueError):
+                service._fetch_ledger_page(None, 1700000000, 0)
+
+        self.assertEqual(len(server.requests), 1)
+
+    def test_pages_get_increasing_nonces(self):
+        with StubServer(ledger_page) as server:
+            service = self.make_service(server)
+            items = service._fetch_new_entries([])
+
+        self.assertEqual(len(items), 120)
+        nonces = [int(x.params["nonce"]) for x in server.requests]
+        self.assertEqual(len(set(nonces)), len(nonces))
+
+
+def table(account: str, *entries: tuple[str, float]) -> HistoryTable:
+    """Ledger of (id, time) deposits for one account"""
+    rows = [
+        dict(
+            id=id,
+            refid=id,
+            aclass="currency",
+            asset="ZUSD",
+            type="deposit",
+            subtype="",
+            time=time,
+            amount="1",
+            fee="0",
+            balance="0",
+        )
+        for id, time in entries
+    ]
+    return HistoryTable.from_raw(rows, account=account)
+
+
+class TestMergeHistories(unittest.TestCase):
+    def test_merges_by_time(self):
+        first = table("a", ("A1", 1), ("A2", 4), ("A3", 5))
+        second = table("b", ("B1", 2), ("B2", 3), ("B3", 6))
+
+        merged = list(merge_histories([first, second]))
+        self.assertEqual(
+            [x.id for x in merged], ["A1", "B1", "B2", "A2", "A3", "B3"]
+        )
+        self.assertEqual([x.account for x in merged], list("abbaab"))
+
+    def test_ties_keep_table_order(self):
+        first = table("a", ("A1", 1), ("A2", 2))
+        second = table("b", ("B1", 1), ("B2", 2))
+        third = table("c", ("C1", 1))
+
+        merged = list(merge_histories([second, first, third]))
+        self.assertEqual([x.id for x in merged], ["B1", "A1", "C1", "B2", "A2"])
+
+    def test_single_and_empty_tables(self):
+        only = table("a", ("A1", 1), ("A2", 2))
+        self.assertEqual([x.id for x in merge_histories([only])], ["A1", "A2"])
+
+        merged = merge_histories([table("b"), only, table("c")])
+        self.assertEqual([x.id for x in merged], ["A1", "A2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
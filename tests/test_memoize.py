@@ -0,0 +1,107 @@
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from config import paths
+from utils.misc import memoize
+
+
+def make_prices(fp: str, **kwargs):
+    """Instance of a class with a memoized method, each call builds a new decorator over the same namespace"""
+
+    class Prices:
+        def __init__(self) -> None:
+            self.calls: list[tuple] = []
+
+        @memoize(fp, **kwargs)
+        def get(self, coin: str, date: str, currency="usd") -> str:
+            self.calls.append((coin, date, currency))
+            return f"{coin} {date} {currency}"
+
+    return Prices()
+
+
+class TestMemoize(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.fp = str(Path(tmp.name) / "memo.sqlite")
+
+    def make(self, **kwargs):
+        prices = make_prices(self.fp, **kwargs)
+        # nothing left for the atexit flush to write into the removed directory
+        self.addCleanup(type(prices).get.flush)
+        return prices
+
+    def test_kwargs_share_a_key(self):
+        prices = self.make()
+        prices.get("bitcoin", "01-01-2021")
+        prices.get("bitcoin", date="01-01-2021")
+        prices.get(coin="bitcoin", date="01-01-2021", currency="usd")
+        prices.get("bitcoin", "01-01-2021", currency="eur")
+
+        self.assertEqual(len(prices.calls), 2)
+        info = type(prices).get.cache_info()
+        self.assertEqual((info.hits, info.misses), (2, 2))
+
+    def test_lru_evicts_at_maxsize(self):
+        prices = self.make(maxsize=2, batch_size=100)
+        for coin in ["bitcoin", "ethereum", "cardano"]:
+            prices.get(coin, "01-01-2021")
+        info = type(prices).get.cache_info()
+        self.assertEqual((info.currsize, info.pending), (2, 3))
+
+        # evicted from memory, but still pending for the disk
+        prices.get("bitcoin", "01-01-2021")
+        prices.get("cardano", "01-01-2021")
+        info = type(prices).get.cache_info()
+        self.assertEqual((info.hits, info.disk_hits, info.misses), (1, 1, 3))
+        self.assertEqual(len(prices.calls), 3)
+
+    def test_flushes_at_batch_size(self):
+        prices = self.make(batch_size=2)
+        prices.get("bitcoin", "01-01-2021")
+        self.assertEqual(type(prices).get.cache_info().pending, 1)
+        prices.get("ethereum", "01-01-2021")
+        self.assertEqual(type(prices).get.cache_info().pending, 0)
+
+        other = self.make()
+        self.assertEqual(other.get("ethereum", "01-01-2021"), "ethereum 01-01-2021 usd")
+        self.assertEqual(other.calls, [])
+        self.assertEqual(type(other).get.cache_info().disk_hits, 1)
+
+    def test_flushes_on_timer(self):
+        prices = self.make(flush_interval=0.05)
+        prices.get("bitcoin", "01-01-2021")
+
+        deadline = time.monotonic() + 5
+        while type(prices).get.cache_info().pending and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(type(prices).get.cache_info().pending, 0)
+
+        other = self.make()
+        other.get("bitcoin", "01-01-2021")
+        self.assertEqual(other.calls, [])
+
+    def test_flushes_at_exit(self):
+        script = (
+            "import sys\n"
+            "from tests.test_memoize import make_prices\n"
+            "prices = make_prices(sys.argv[1], flush_interval=3600)\n"
+            "prices.get('bitcoin', '01-01-2021')\n"
+            "assert type(prices).get.cache_info().pending == 1\n"
+        )
+        subprocess.run(
+            [sys.executable, "-c", script, self.fp], cwd=paths.ROOT_DIR, check=True
+        )
+
+        prices = self.make()
+        prices.get("bitcoin", "01-01-2021")
+        self.assertEqual(prices.calls, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from classes.price_store import PriceStore
+
+
+class TestPriceStore(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+        self.store = PriceStore(self.root)
+
+    def test_merge_round_trip(self):
+        self.store.merge("bitcoin", "usd", [[2000, 2.0], [1000, 1.0]], [[1, 2]])
+        self.store.merge("bitcoin", "usd", [[3000, 3.0], [2000, 2.5]], [[1, 3]])
+
+        # a fresh store reads the pair back from disk
+        series = PriceStore(self.root).get("bitcoin", "usd")
+        self.assertEqual(list(series.times), [1000, 2000, 3000])
+        self.assertEqual(list(series.prices), [1.0, 2.5, 3.0])
+        self.assertEqual(series.coverage, [[1, 3]])
+
+    def test_empty_fetch_is_not_saved(self):
+        self.store.merge("nothing", "usd", [], [[1, 2]])
+
+        self.assertFalse(self.store.has("nothing", "usd"))
+        series = self.store.get("nothing", "usd")
+        self.assertEqual(len(series), 0)
+        self.assertEqual(series.coverage, [])
+
+    def test_empty_file_counts_as_missing(self):
+        # as written before empty fetches were skipped
+        self.store._write(self.store._data_path("nothing", "usd"), [], [])
+        self.store._coverage_cache("nothing", "usd").dump([[1, 2]])
+
+        self.assertFalse(self.store.has("nothing", "usd"))
+        # so the range is fetched again
+        self.assertEqual(self.store.get("nothing", "usd").coverage, [])
+
+        self.store.merge("nothing", "usd", [[1000, 1.0]], [[1, 2]])
+        self.assertTrue(self.store.has("nothing", "usd"))
+        self.assertEqual(self.store.get("nothing", "usd").index.closest(1), (1, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
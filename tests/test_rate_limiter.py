@@ -0,0 +1,73 @@
+import json
+import multiprocessing
+import tempfile
+import unittest
+from pathlib import Path
+
+from classes.rate_limiter import RateLimiter
+
+CALLS, PERIOD = 2, 1
+
+
+def reserve_slots(path: str, count: int) -> None:
+    """Run in a separate process, each one with its own limiter over the shared file"""
+    limiter = RateLimiter(path)
+    for _ in range(count):
+        limiter.reserve(CALLS, PERIOD)
+
+
+class TestRateLimiter(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = Path(tmp.name) / "limits" / "scope.json"
+
+    def assertSpaced(self, slots: list[float]):
+        self.assertEqual(slots, sorted(slots))
+        for before, after in zip(slots, slots[CALLS:]):
+            self.assertGreaterEqual(after - before, PERIOD - 1e-6)
+
+    def test_local_slots_are_spaced(self):
+        limiter = RateLimiter()
+        delays = [limiter.reserve(CALLS, PERIOD) for _ in range(6)]
+
+        self.assertSpaced(list(limiter._slots))
+        self.assertAlmostEqual(delays[-1], 2 * PERIOD, delta=0.1)
+
+    def test_limiters_on_one_file_share_the_budget(self):
+        first, second = RateLimiter(self.path), RateLimiter(self.path)
+        delays = [x.reserve(CALLS, PERIOD) for x in [first, second] * 3]
+
+        # the second limiter queues behind the first one's reservations
+        self.assertAlmostEqual(delays[-1], 2 * PERIOD, delta=0.1)
+        # a limiter on another file has its own budget
+        other = RateLimiter(self.path.with_name("other.json"))
+        self.assertLess(other.reserve(CALLS, PERIOD), 0.1)
+
+    def test_processes_share_the_budget(self):
+        ctx = multiprocessing.get_context("spawn")
+        procs = [
+            ctx.Process(target=reserve_slots, args=(str(self.path), 3))
+            for _ in range(4)
+        ]
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            proc.join(timeout=30)
+            self.assertEqual(proc.exitcode, 0)
+
+        state = json.loads(self.path.read_text())
+        self.assertEqual(len(state["slots"]), 12)
+        self.assertEqual(state["max_period"], PERIOD)
+        self.assertSpaced(state["slots"])
+
+    def test_corrupt_file_is_reset(self):
+        self.path.parent.mkdir(parents=True)
+        self.path.write_text("{not json")
+
+        self.assertLess(RateLimiter(self.path).reserve(CALLS, PERIOD), 0.1)
+        self.assertEqual(len(json.loads(self.path.read_text())["slots"]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,19 +1,33 @@
 from decimal import Decimal
 from classes.parser.value import Value
-from classes.services.gecko_service import GeckoService
-from tools.calc_gains import K2G_ID_MAP
-from tools.calc_wallet import HistoryParser, Wallet
-from classes.services.kraken_service import KrakenService
+from classes.services.rate_service import StalenessPolicy
+from tools.calc_wallet import HistoryParser
 from datetime import datetime, timezone
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from tools.pipeline import Pipeline
+
+# a deposit valued from a sample days away is worse than no report at all,
+# and one more than a day off is refetched before settling for it
+STALENESS = StalenessPolicy(historical_refresh=86400, strict=True)
 
-if __name__ == "__main__":
-    gecko = GeckoService()
-    kraken = KrakenService()
-    history = kraken.fetch_history()
-    wallet = Wallet()
+
+def run(ctx: "Pipeline") -> None:
+    rates = ctx.rates
+    history = ctx.history
 
     tgts = [x for x in history if x.type == "deposit" or x.type == "withdrawal"]
 
+    # fetch whatever's missing for every pair at once, the lookups below then stay in the cache
+    currencies = [HistoryParser.CURRENCY_MAP.get(x.asset, x.asset) for x in tgts]
+    rates.prefetch(
+        [(x.time, ctx.id_map[c]) for x, c in zip(tgts, currencies) if c != "USD"],
+        "usd",
+        staleness=STALENESS,
+    )
+
+    print("\ndeposits")
     net = 0
     for x in tgts:
         dt = datetime.fromtimestamp(x.time, tz=timezone.utc)
@@ -23,16 +37,13 @@ if __name__ == "__main__":
         raw = Value(Decimal(amt), asset)
         cvt = Value(Decimal(amt), asset)
         if cvt.currency != "USD":
-            elapsed = (datetime.now(tz=timezone.utc) - dt).days
-            thresh = 86400 if elapsed > 1 else 6 * 3600
-            assert_thresh = 2 * 86400 if elapsed > 1 else 6 * 3600
-
-            (rate, time_diff) = gecko.get_rate(x.time, K2G_ID_MAP[cvt.currency], "usd")
-            if abs(time_diff) > thresh:
-                (rate, time_diff) = gecko.get_rate(
-                    x.time, K2G_ID_MAP[cvt.currency], "usd", live=True
-                )
-                assert abs(time_diff) <= assert_thresh
+            (rate, _) = rates.get_rate(
+                x.time,
+                ctx.id_map[cvt.currency],
+                "usd",
+                staleness=STALENESS,
+                interpolate=ctx.interpolate,
+            )
 
             cvt = Value(cvt.quantity * rate, "USD")
 
@@ -44,3 +55,12 @@ if __name__ == "__main__":
         print(msg)
 
     print(f"------\ntotal balance: {net:>10,.2f}")
+
+
+if __name__ == "__main__":
+    import sys
+
+    from tools.stonks import main
+
+    # same flags as the stonks cli (--live, --method, --profile, ...)
+    main(["deposits", *sys.argv[1:]])
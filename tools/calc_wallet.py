@@ -1,141 +1,160 @@
 from dataclasses import dataclass, field
 
-import config.configure_logging
+from config import paths
+from classes.json_log import JsonLog
 from classes.parser.tsn import Tsn, Value
-from classes.services.kraken_service import HistoryItem, KrakenService
+from classes.services.kraken_service import HistoryItem, HistoryTable, merge_histories
+from utils import instrument
+from utils.misc import gc_paused
+import bisect
+import heapq
 import logging
-import datetime
+from abc import ABCMeta, abstractmethod
+from collections import deque
+from decimal import Decimal
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator
+
+if TYPE_CHECKING:
+    from tools.pipeline import Pipeline
 
 LOG = logging.getLogger(__name__)
 
+WALLET_CHECKPOINT = JsonLog(paths.CACHE_DIR / "wallet" / "checkpoint.jsonl")
+
 
 class HistoryParser:
     CURRENCY_MAP = {"ZUSD": "USD", "USD.HOLD": "USD", "ATOM.S": "ATOM"}
+    # legs of a trade / spend that are this many seconds apart are not considered a pair
+    PAIR_WINDOW = 3600
 
     @classmethod
-    def parse_history(cls, history: list[HistoryItem]) -> list[Tsn]:
-        history = sorted(history, key=lambda it: it.time)
-
-        # Create transactions
-        tsns = []
-        idx = -1
-        while True:
-            idx += 1
-            if idx == len(history):
-                break
-            item: HistoryItem = history[idx]
-            item = cls._map_currency(item)
+    def parse_history(
+        cls, history: HistoryTable | Iterable[HistoryItem]
+    ) -> list[Tsn]:
+        return list(cls.iter_history(history))
+
+    @classmethod
+    def iter_history(
+        cls, history: HistoryTable | Iterable[HistoryItem]
+    ) -> Iterator[Tsn]:
+        """
+        Yields transactions in ledger order
+        The two legs of a trade / spend are paired by (account, refid), so they don't need to be adjacent.
+        Only unmatched legs (and the transactions queued behind them) are held in memory.
+        Lists are sorted first, any other iterable (eg. merge_histories()) must already be in time order.
+        """
+        if isinstance(history, list):
+            history = sorted(history, key=lambda it: it.time)
 
-            if item.asset in cls.CURRENCY_MAP:
-                item.asset = cls.CURRENCY_MAP[item.asset]
+        # (account, refid) -> (seq, leg) for legs still waiting on their pair, oldest first
+        pending: dict[tuple[str, str], tuple[int, HistoryItem]] = dict()
+        # (date, seq, tsn) for transactions that can't be emitted before an older pending leg
+        ready: list[tuple[float, int, Tsn]] = []
+
+        for seq, item in enumerate(history):
+            while pending:
+                _, oldest = next(iter(pending.values()))
+                if item.time - oldest.time <= cls.PAIR_WINDOW:
+                    break
+                del pending[(oldest.account, oldest.refid)]
+                cls._warn_unpaired(oldest)
+
+            asset = cls._map_currency(item.asset)
+            tsn_seq = seq
 
             match item.type:
                 case "deposit":
                     assert item.amount > 0
 
-                    tsns.append(
-                        Tsn(
-                            date=item.time,
-                            dst_value=Value(item.amount, item.asset),
-                            fee=Value(item.fee, item.asset),
-                            meta=dict(type="deposit", id=item.refid),
-                        )
+                    tsn = Tsn(
+                        date=item.time,
+                        dst_value=Value(item.amount, asset),
+                        fee=Value(item.fee, asset),
+                        meta=dict(type="deposit", id=item.refid),
                     )
                 case "withdrawal":
                     assert item.amount < 0
 
-                    tsns.append(
-                        Tsn(
-                            date=item.time,
-                            src_value=Value(-1 * item.amount, item.asset),
-                            fee=Value(item.fee, item.asset),
-                            meta=dict(type="withdrawal", id=item.refid),
-                        )
-                    )
-                case "spend":
-                    assert item.amount < 0
-
-                    idx_next = idx + 1
-                    assert idx_next < len(history)
-                    item_next = cls._map_currency(history[idx_next])
-                    assert item.refid == item_next.refid
-                    assert item_next.amount > 0
-
-                    assert item.fee == 0 or item_next.fee == 0
-                    if item.fee > 0:
-                        fee = Value(quantity=item.fee, currency=item.asset)
-                    else:
-                        fee = Value(quantity=item_next.fee, currency=item_next.asset)
-
-                    tsns.append(
-                        Tsn(
-                            date=item.time,
-                            src_value=Value(-1 * item.amount, item.asset),
-                            dst_value=Value(item_next.amount, item_next.asset),
-                            fee=fee,
-                            meta=dict(type="trade", id=item.refid),
-                        )
+                    tsn = Tsn(
+                        date=item.time,
+                        src_value=Value(-1 * item.amount, asset),
+                        fee=Value(item.fee, asset),
+                        meta=dict(type="withdrawal", id=item.refid),
                     )
-
-                    idx += 1
-                case "receive":
-                    raise ValueError
                 case "staking":
                     assert item.amount > 0
 
-                    tsns.append(
-                        Tsn(
-                            date=item.time,
-                            dst_value=Value(item.amount, item.asset),
-                            fee=Value(item.fee, item.asset),
-                            meta=dict(type="staking", id=item.refid),
-                        )
+                    tsn = Tsn(
+                        date=item.time,
+                        dst_value=Value(item.amount, asset),
+                        fee=Value(item.fee, asset),
+                        meta=dict(type="staking", id=item.refid),
                     )
-                case "trade":
-                    idx_next = idx + 1
-                    assert idx_next < len(history)
-
-                    item_next = cls._map_currency(history[idx_next])
-                    if item.refid != item_next.refid:
-                        LOG.warning(
-                            f"Skipping. No pair for {item.asset} {item.amount} ({item.refid})."
-                        )
+                case "trade" | "spend" | "receive":
+                    key = (item.account, item.refid)
+                    other = pending.pop(key, None)
+                    if other is None:
+                        pending[key] = (seq, item)
                         continue
-                    else:
-                        assert item.amount < 0
-                        assert item_next.amount > 0
-
-                    assert item.fee == 0 or item_next.fee == 0
-                    if item.fee > 0:
-                        fee = Value(quantity=item.fee, currency=item.asset)
-                    else:
-                        fee = Value(quantity=item_next.fee, currency=item_next.asset)
-
-                    tsns.append(
-                        Tsn(
-                            date=item.time,
-                            src_value=Value(-1 * item.amount, item.asset),
-                            dst_value=Value(item_next.amount, item_next.asset),
-                            fee=fee,
-                            meta=dict(type="trade", id=item.refid),
-                        )
-                    )
 
-                    idx += 1
+                    # order the trade by whichever leg came first
+                    tsn_seq, other_item = other
+                    tsn = cls._pair_legs(other_item, item)
                 case "transfer":
-                    pass
+                    continue
                 case default:
                     raise ValueError
 
-        return tsns
+            tsn.meta["account"] = item.account
+            heapq.heappush(ready, (tsn.date, tsn_seq, tsn))
+
+            # anything sorting before the oldest unmatched leg can't be preceded by that leg's trade
+            if pending:
+                seq_pending, leg = next(iter(pending.values()))
+                watermark = (leg.time, seq_pending)
+                while ready and ready[0][:2] < watermark:
+                    yield heapq.heappop(ready)[2]
+            else:
+                while ready:
+                    yield heapq.heappop(ready)[2]
+
+        for _, leg in pending.values():
+            cls._warn_unpaired(leg)
+        while ready:
+            yield heapq.heappop(ready)[2]
 
     @classmethod
-    def _map_currency(cls, item: HistoryItem) -> HistoryItem:
-        item = item.copy()
-        new_val = cls.CURRENCY_MAP.get(item.asset)
-        if new_val:
-            item.asset = new_val
-        return item
+    def _pair_legs(cls, a: HistoryItem, b: HistoryItem) -> Tsn:
+        src, dst = (a, b) if a.amount < 0 else (b, a)
+        assert src.amount < 0
+        assert dst.amount > 0
+
+        src_asset = cls._map_currency(src.asset)
+        dst_asset = cls._map_currency(dst.asset)
+
+        assert src.fee == 0 or dst.fee == 0
+        if src.fee > 0:
+            fee = Value(quantity=src.fee, currency=src_asset)
+        else:
+            fee = Value(quantity=dst.fee, currency=dst_asset)
+
+        return Tsn(
+            date=src.time,
+            src_value=Value(-1 * src.amount, src_asset),
+            dst_value=Value(dst.amount, dst_asset),
+            fee=fee,
+            meta=dict(type="trade", id=src.refid),
+        )
+
+    @classmethod
+    def _warn_unpaired(cls, item: HistoryItem) -> None:
+        LOG.warning(
+            f"Skipping. No pair for {cls._map_currency(item.asset)} {item.amount} ({item.refid})."
+        )
+
+    @classmethod
+    def _map_currency(cls, asset: str) -> str:
+        return cls.CURRENCY_MAP.get(asset, asset)
 
 
 # Create currency stacks
@@ -155,9 +174,17 @@ class Wad:
     deductions: list[Deduction] = field(default_factory=list)
     src: "Wad | None" = None
 
+    # running total, kept in sync by deduct() so reads don't re-sum the deductions
+    remaining: Decimal = field(init=False)
+
+    def __post_init__(self):
+        self.remaining = self.total.quantity
+        for x in self.deductions:
+            self.remaining -= x.value.quantity
+
     def deduct(self, value: Value, tsn: Tsn, dst: "Wad | None" = None) -> None:
         assert value.currency == self.total.currency
-        assert value.quantity <= self.available.quantity
+        assert value.quantity <= self.remaining
 
         self.deductions.append(
             Deduction(
@@ -167,12 +194,12 @@ class Wad:
                 dst=dst,
             )
         )
+        # subtracted directly, so deducting all of what's left is exactly 0 instead of a rounding residue
+        self.remaining -= value.quantity
 
     @property
     def available(self) -> Value:
-        total_deductions = sum(x.value.quantity for x in self.deductions)
-        result = self.total.quantity - total_deductions
-        return Value(quantity=result, currency=self.total.currency)
+        return Value(quantity=self.remaining, currency=self.total.currency)
 
     def __repr__(self):
         # Default __repr__ was slowing down debugger
@@ -180,11 +207,106 @@ class Wad:
         return f"{a.currency} {a.quantity:.3f} / {self.total.quantity:.3f}"
 
 
+class LotSelector(metaclass=ABCMeta):
+    """
+    Decides which wad a pull deducts from next
+    Only wads that still hold a balance are indexed, exhausted ones are dropped as they're reached,
+    so a pull only touches the wads it consumes
+    """
+
+    @abstractmethod
+    def push(self, wad: Wad) -> None:
+        pass
+
+    @abstractmethod
+    def peek(self) -> Wad | None:
+        """Next wad to deduct from, or None if every indexed wad is exhausted"""
+        pass
+
+
+class FifoLots(LotSelector):
+    def __init__(self) -> None:
+        self.wads: deque[Wad] = deque()
+
+    def push(self, wad: Wad) -> None:
+        self.wads.append(wad)
+
+    def peek(self) -> Wad | None:
+        while self.wads and self.wads[0].remaining <= 0:
+            self.wads.popleft()
+        return self.wads[0] if self.wads else None
+
+
+class LifoLots(FifoLots):
+    def peek(self) -> Wad | None:
+        while self.wads and self.wads[-1].remaining <= 0:
+            self.wads.pop()
+        return self.wads[-1] if self.wads else None
+
+
+class CostLots(LotSelector):
+    """
+    Heap keyed by the unit cost of each wad, cheapest first (or most expensive first if highest)
+    Ties go to the older wad
+    """
+
+    def __init__(self, cost: Callable[[Wad], Decimal | float], highest: bool) -> None:
+        self.cost = cost
+        self.sign = -1 if highest else 1
+        self.heap: list[tuple[Decimal | float, int, Wad]] = []
+        self.count = 0
+
+    def push(self, wad: Wad) -> None:
+        heapq.heappush(self.heap, (self.sign * self.cost(wad), self.count, wad))
+        self.count += 1
+
+    def peek(self) -> Wad | None:
+        while self.heap and self.heap[0][2].remaining <= 0:
+            heapq.heappop(self.heap)
+        return self.heap[0][2] if self.heap else None
+
+
+LOT_METHODS = ["fifo", "lifo", "hifo", "lofo"]
+
+
+def make_lots(
+    method: str, cost: Callable[[Wad], Decimal | float] | None = None
+) -> LotSelector:
+    """
+    hifo / lofo (highest / lowest cost first) need a cost function returning the unit cost of a wad,
+    usually its price in a common currency at wad.tsn.date
+    """
+    match method:
+        case "fifo":
+            return FifoLots()
+        case "lifo":
+            return LifoLots()
+        case "hifo" | "lofo":
+            if cost is None:
+                raise ValueError(f"Lot method {method} needs a cost function")
+            return CostLots(cost, highest=method == "hifo")
+        case default:
+            raise ValueError(f"Unknown lot method {method}, expected one of {LOT_METHODS}")
+
+
 @dataclass
 class Stack:
     currency: str
+    # every wad ever pushed, in insertion order
     wads: list[Wad] = field(default_factory=list)
 
+    # running sum of wad.remaining over all wads, summed from the wads if not given
+    balance: Decimal | None = None
+    # index over the wads that still hold a balance, picks the next one to deduct from
+    lots: LotSelector = field(default_factory=FifoLots, repr=False)
+
+    def __post_init__(self):
+        if self.balance is None:
+            self.balance = sum((wad.remaining for wad in self.wads), Decimal(0))
+        for wad in self.wads:
+            if wad.remaining > 0:
+                self.lots.push(wad)
+
     def pull(self, value: Value, tsn: Tsn, create_dst=True) -> list[Wad]:
         """
         @todo: instead of null checks, make a sep fn
@@ -195,29 +317,20 @@ class Stack:
         if create_dst:
             assert dst is not None
 
-        # Get non-zero wads
-        rem = value.quantity
-        tgts: list[Wad] = []
-        for wad in self.wads:
-            available = wad.available.quantity
-
-            if available > 0:
-                tgts.append(wad)
-                rem -= min(rem, available)
-
-            if rem == 0:
-                break
-        else:
-            if rem > 10**-3:
-                raise ValueError(
-                    f"Attempted to deduct {value.quantity} {value.currency} but stack only contains {value.quantity - rem} {self.currency}"
-                )
+        if value.quantity - self.balance > 10**-3:
+            raise ValueError(
+                f"Attempted to deduct {value.quantity} {value.currency} but stack only contains {self.balance} {self.currency}"
+            )
 
-        # Deduct
+        # Deduct, in the order picked by the lot selector
         result: list[Wad] = []
         rem = value.quantity
-        for tgt in tgts:
-            amount = min(rem, tgt.available.quantity)
+        while rem > 0:
+            tgt = self.lots.peek()
+            if tgt is None:
+                break
+
+            amount = min(rem, tgt.remaining)
 
             if create_dst:
                 val = (amount * dst.quantity) / tsn.src_value.quantity  # type: ignore
@@ -231,12 +344,9 @@ class Stack:
                 tsn=tsn,
                 dst=new_wad,
             )
+            self.balance -= amount
 
             rem -= amount
-            if rem == 0:
-                break
-            elif rem < 0:
-                raise ValueError
 
         return result
 
@@ -245,17 +355,64 @@ class Stack:
             x = Wad(total=x, tsn=tsn)
         assert x.total.currency == self.currency
         self.wads.append(x)
+        self.balance += x.remaining
+        if x.remaining > 0:
+            self.lots.push(x)
 
     @property
     def available(self) -> Value:
-        quantity = sum(x.available.quantity for x in self.wads)
-        return Value(quantity=quantity, currency=self.currency)
+        return Value(quantity=self.balance, currency=self.currency)
+
+
+@dataclass
+class BalanceLog:
+    """
+    Per-currency balance after every transaction that touched it, in time order
+    Answers point-in-time balance queries with a binary search instead of a replay
+    """
+
+    times: dict[str, list[float]] = field(default_factory=dict)
+    # running balance after the event at the same index in times
+    balances: dict[str, list[Decimal]] = field(default_factory=dict)
+
+    def record(self, currency: str, time: float, balance: Decimal) -> None:
+        times = self.times.setdefault(currency, [])
+        balances = self.balances.setdefault(currency, [])
+
+        if times and time < times[-1]:
+            raise ValueError(
+                f"{currency} balance recorded at {time}, before the previous event at {times[-1]}"
+            )
+        if times and times[-1] == time:
+            balances[-1] = balance
+        else:
+            times.append(time)
+            balances.append(balance)
+
+    def balance_at(self, currency: str, time: float) -> Decimal:
+        """Balance right after every transaction at or before time"""
+        times = self.times.get(currency)
+        if not times:
+            return 0
+
+        idx = bisect.bisect_right(times, time)
+        return self.balances[currency][idx - 1] if idx else 0
+
+    def balances_at(self, time: float) -> dict[str, Decimal]:
+        return {currency: self.balance_at(currency, time) for currency in self.times}
 
 
 @dataclass
 class Wallet:
     tsns: list[Tsn] = field(default_factory=list)
     stacks: dict[str, Stack] = field(default_factory=dict)
+    balances: BalanceLog = field(default_factory=BalanceLog)
+    # which wads a pull deducts from first, see make_lots()
+    method: str = "fifo"
+    cost: Callable[[Wad], Decimal | float] | None = field(default=None, repr=False)
+
+    # bump whenever to_dict() changes shape, older checkpoints are then ignored
+    CHECKPOINT_VERSION = 6
 
     def transact(self, tsn: Tsn) -> None:
         src_stack: Stack | None = None
@@ -282,22 +439,303 @@ class Wallet:
         if tsn.fee.quantity > 0:
             fee_stack.pull(tsn.fee, tsn=tsn, create_dst=False)
 
+        for stack in {id(x): x for x in [src_stack, dst_stack, fee_stack] if x}.values():
+            self.balances.record(stack.currency, tsn.date, stack.balance)
+
         self.tsns.append(tsn)
 
+    def balance_at(self, currency: str, time: float) -> Value:
+        return Value(self.balances.balance_at(currency, time), currency)
+
+    def balances_at(self, time: float) -> dict[str, Value]:
+        return {
+            currency: Value(quantity, currency)
+            for currency, quantity in self.balances.balances_at(time).items()
+        }
+
     def get_stack(self, currency: str) -> Stack:
         if currency not in self.stacks:
-            self.stacks[currency] = Stack(currency)
+            self.stacks[currency] = Stack(
+                currency, lots=make_lots(self.method, self.cost)
+            )
         return self.stacks[currency]
 
+    @classmethod
+    def from_history(
+        cls,
+        history: HistoryTable | list[HistoryTable],
+        checkpoint: JsonLog | None = None,
+        method="fifo",
+        cost: Callable[[Wad], Decimal | float] | None = None,
+    ) -> "Wallet":
+        """
+        Replays the ledger into a wallet
+        history can also be one table per account, their rows are merged by time as they're replayed
+        If a checkpoint is given, resumes from it when it still matches the ledger, and appends what was replayed
+        method / cost pick the lot selection, see make_lots()
+        """
+        tables = history if isinstance(history, list) else [history]
+
+        make_lots(method, cost)  # fail early on a bad method
+        wallet = cls(method=method, cost=cost)
+        starts = {x.account: 0 for x in tables}
+        unapplied: dict[str, list[HistoryItem]] = {x.account: [] for x in tables}
+        resumed = False
+
+        saved = checkpoint.header() if checkpoint else None
+        if saved and saved.get("version") != cls.CHECKPOINT_VERSION:
+            LOG.info("Wallet checkpoint is from an older format, replaying from scratch")
+            saved = None
+        if saved and saved["method"] != method:
+            LOG.info("Wallet checkpoint uses another lot method, replaying from scratch")
+            saved = None
+
+        if saved:
+            # resume only if every ledger up to the checkpoint is the one it was built from
+            last_time = saved["time"]
+            rows = {x.account: bisect.bisect_right(x.time, last_time) for x in tables}
+            if rows == saved["rows"]:
+                with instrument.stage("wallet.checkpoint_load"):
+                    segments = checkpoint.load()  # type: ignore
+                    wallet = cls.from_dict(segments, method=method, cost=cost)
+                starts = rows
+                resumed = True
+
+                # rows sharing the checkpoint's timestamp may not have been applied yet
+                applied = {(account, id) for account, id in saved["ids"]}
+                for table in tables:
+                    lo = bisect.bisect_left(table.time, last_time)
+                    for idx in range(lo, starts[table.account]):
+                        if (table.account, table.refid[idx]) not in applied:
+                            unapplied[table.account].append(table[idx])
+            else:
+                LOG.info("Wallet checkpoint doesn't match the ledger, replaying from scratch")
+
+        streams: list = []
+        for table in tables:
+            rows = table.tail(starts[table.account])
+            pending = unapplied[table.account]
+            streams.append(pending + list(rows) if pending else rows)
+        rows = streams[0] if len(streams) == 1 else merge_histories(streams)
+
+        marks = wallet.marks()
+        count = len(wallet.tsns)
+        # parsing is lazy, so this times both
+        with instrument.stage("wallet.replay"):
+            for tsn in HistoryParser.iter_history(rows):
+                wallet.transact(tsn)
+        LOG.debug(f"Replayed {len(wallet.tsns) - count} new transactions")
+        instrument.count("wallet.replay", len(wallet.tsns) - count)
+
+        if checkpoint and len(wallet.tsns) > count:
+            last_time = wallet.tsns[-1].date
+            header = dict(
+                version=cls.CHECKPOINT_VERSION,
+                method=method,
+                time=last_time,
+                ids=[
+                    [x.meta["account"], x.meta["id"]]
+                    for x in wallet.tsns
+                    if x.date == last_time
+                ],
+                rows={x.account: bisect.bisect_right(x.time, last_time) for x in tables},
+            )
+            with instrument.stage("wallet.checkpoint_dump"):
+                segment = wallet.to_dict(since=marks)
+                if resumed:
+                    checkpoint.append(segment, header)
+                else:
+                    checkpoint.dump([segment], header)
+
+        return wallet
+
+    def marks(self) -> dict:
+        """Sizes of the wallet's append-only parts, to_dict(since=...) then only dumps what was added after them"""
+        return dict(
+            tsns=len(self.tsns),
+            wads={currency: len(stack.wads) for currency, stack in self.stacks.items()},
+            balances={currency: len(x) for currency, x in self.balances.times.items()},
+        )
+
+    def to_dict(self, since: dict | None = None) -> dict:
+        """
+        Plain json-able form of what was added since the marks() given, or of the whole wallet
+        Columns are stored per currency, tsns are referenced by their index in wallet.tsns
+        and wads by their index in their stack. A wad's src is in the stack of its tsn's src currency,
+        a deduction's dst in the stack of its tsn's dst currency.
+        balances are [start, times, balances] and replace that currency's log from start on
+        (the first one may be an update of an earlier event at the same time)
+        """
+        if since is None:
+            since = dict(tsns=0, wads=dict(), balances=dict())
+
+        new_tsns = self.tsns[since["tsns"] :]
+        tsn_idx = {id(x): idx for idx, x in enumerate(new_tsns, since["tsns"])}
+        wad_idx = {
+            id(wad): idx
+            for stack in self.stacks.values()
+            for idx, wad in enumerate(stack.wads)
+        }
+
+        quantity = lambda v: str(v.quantity) if v else None
+        currency = lambda v: v.currency if v else None
+        tsns = dict(
+            date=[x.date for x in new_tsns],
+            fee=[str(x.fee.quantity) for x in new_tsns],
+            fee_currency=[x.fee.currency for x in new_tsns],
+            src=[quantity(x.src_value) for x in new_tsns],
+            src_currency=[currency(x.src_value) for x in new_tsns],
+            dst=[quantity(x.dst_value) for x in new_tsns],
+            dst_currency=[currency(x.dst_value) for x in new_tsns],
+            meta=[x.meta for x in new_tsns],
+        )
+
+        wads = dict()
+        deductions = dict()
+        for name, stack in self.stacks.items():
+            added = stack.wads[since["wads"].get(name, 0) :]
+            if added:
+                wads[name] = dict(
+                    total=[str(x.total.quantity) for x in added],
+                    tsn=[tsn_idx[id(x.tsn)] for x in added],
+                    src=[wad_idx[id(x.src)] if x.src else None for x in added],
+                )
+
+            # deductions only ever come from new tsns, so the new ones are a suffix of each wad's list
+            columns = dict(wad=[], quantity=[], tsn=[], dst=[])
+            for idx, wad in enumerate(stack.wads):
+                start = len(wad.deductions)
+                while start and id(wad.deductions[start - 1].tsn) in tsn_idx:
+                    start -= 1
+                for ddt in wad.deductions[start:]:
+                    columns["wad"].append(idx)
+                    columns["quantity"].append(str(ddt.value.quantity))
+                    columns["tsn"].append(tsn_idx[id(ddt.tsn)])
+                    columns["dst"].append(wad_idx[id(ddt.dst)] if ddt.dst else None)
+            if columns["wad"]:
+                deductions[name] = columns
+
+        balances = dict()
+        for name, times in self.balances.times.items():
+            start = max(since["balances"].get(name, 0) - 1, 0)
+            if start < len(times):
+                quantities = self.balances.balances[name][start:]
+                balances[name] = [start, times[start:], [str(x) for x in quantities]]
+
+        return dict(
+            tsns=tsns,
+            wads=wads,
+            deductions=deductions,
+            stacks={name: str(stack.balance) for name, stack in self.stacks.items()},
+            balances=balances,
+        )
+
+    @classmethod
+    def from_dict(
+        cls,
+        data: dict | list[dict],
+        method="fifo",
+        cost: Callable[[Wad], Decimal | float] | None = None,
+    ) -> "Wallet":
+        """Wallet from a to_dict() result, or from several of them applied in order"""
+        with gc_paused():
+            return cls._from_dict(data if isinstance(data, list) else [data], method, cost)
+
+    @classmethod
+    def _from_dict(
+        cls,
+        segments: list[dict],
+        method: str,
+        cost: Callable[[Wad], Decimal | float] | None,
+    ) -> "Wallet":
+        wallet = cls(method=method, cost=cost)
+        tsns = wallet.tsns
+        wads: dict[str, list[Wad]] = dict()
+        stacks: dict[str, str] = dict()
+
+        for segment in segments:
+            columns = segment["tsns"]
+            for date, fee, fee_c, src, src_c, dst, dst_c, meta in zip(
+                columns["date"],
+                columns["fee"],
+                columns["fee_currency"],
+                columns["src"],
+                columns["src_currency"],
+                columns["dst"],
+                columns["dst_currency"],
+                columns["meta"],
+            ):
+                tsns.append(
+                    Tsn(
+                        date=date,
+                        fee=Value(Decimal(fee), fee_c),
+                        src_value=Value(Decimal(src), src_c) if src_c else None,
+                        dst_value=Value(Decimal(dst), dst_c) if dst_c else None,
+                        meta=meta,
+                    )
+                )
+
+            # every wad is created before any src is linked, the src may be a new wad of another stack
+            linked = []
+            for name, columns in segment["wads"].items():
+                stack = wads.setdefault(name, [])
+                for total, tsn in zip(columns["total"], columns["tsn"]):
+                    stack.append(Wad(total=Value(Decimal(total), name), tsn=tsns[tsn]))
+                linked.append((stack[len(stack) - len(columns["src"]) :], columns["src"]))
+            for added, srcs in linked:
+                for wad, src in zip(added, srcs):
+                    if src is not None:
+                        wad.src = wads[wad.tsn.src_value.currency][src]  # type: ignore
+
+            for name, columns in segment["deductions"].items():
+                stack = wads[name]
+                for idx, quantity, tsn_idx, dst in zip(
+                    columns["wad"], columns["quantity"], columns["tsn"], columns["dst"]
+                ):
+                    wad = stack[idx]
+                    tsn = tsns[tsn_idx]
+                    value = Value(Decimal(quantity), name)
+                    wad.deductions.append(
+                        Deduction(
+                            value=value,
+                            tsn=tsn,
+                            src=wad,
+                            dst=wads[tsn.dst_value.currency][dst] if dst is not None else None,  # type: ignore
+                        )
+                    )
+                    # same order of subtractions as deduct(), so remaining comes out identical
+                    wad.remaining -= value.quantity
+
+            for name, (start, times, quantities) in segment["balances"].items():
+                wallet.balances.times.setdefault(name, [])[start:] = times
+                wallet.balances.balances.setdefault(name, [])[start:] = [
+                    Decimal(x) for x in quantities
+                ]
+
+            stacks = segment["stacks"]
+
+        for name, balance in stacks.items():
+            wallet.stacks[name] = Stack(
+                currency=name,
+                wads=wads.get(name, []),
+                balance=Decimal(balance),
+                lots=make_lots(method, cost),
+            )
+
+        return wallet
+
+
+def run(ctx: "Pipeline") -> None:
+    print("\nbalances")
+    for currency, stack in ctx.wallet.stacks.items():
+        if stack.balance:
+            print(f"{currency:<5} | {stack.available.quantity:>16.8f}")
+
 
 if __name__ == "__main__":
-    kraken = KrakenService()
-    history = kraken.fetch_history()
-    tsns = HistoryParser.parse_history(history)
+    import sys
 
-    wallet = Wallet()
-    for tsn in tsns:
-        dt = datetime.datetime.fromtimestamp(tsn.date)
-        wallet.transact(tsn)
+    from tools.stonks import main
 
-    print(wallet)
+    # same flags as the stonks cli (--live, --method, --profile, ...)
+    main(["wallet", *sys.argv[1:]])
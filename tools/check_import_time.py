@@ -0,0 +1,78 @@
+"""
+Fails if importing an entry point takes longer than its budget, or eagerly pulls in a module that should be lazy
+Run from the repo root: python -m tools.check_import_time [module ...]
+"""
+
+import subprocess
+import sys
+
+from config import paths
+
+# module -> max cumulative import time in milliseconds
+BUDGETS = {
+    "tools.calc_wallet": 120,
+    "tools.calc_gains": 120,
+    "tools.calc_deposits": 120,
+    "tools.stonks": 120,
+}
+
+# only needed once something is fetched, so they must be imported inside the functions that use them
+LAZY_MODULES = ["requests", "urllib3", "asyncio"]
+
+# each import is measured in a fresh interpreter, best of this many runs to smooth out noise
+RUNS = 3
+
+
+def measure(module: str) -> tuple[float, set[str]]:
+    """(cumulative import time in ms, every module imported along the way)"""
+    best = None
+    imported: set[str] = set()
+
+    for _ in range(RUNS):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=paths.ROOT_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+
+        # lines look like "import time:  self [us] | cumulative | <indent>name"
+        for line in proc.stderr.splitlines():
+            if not line.startswith("import time:"):
+                continue
+            parts = line.split("|")
+            name = parts[2].strip()
+            if name == "package":
+                continue
+            imported.add(name)
+            if name == module:
+                elapsed = int(parts[1]) / 1000
+                best = elapsed if best is None else min(best, elapsed)
+
+    assert best is not None, f"{module} was not imported"
+    return best, imported
+
+
+def check(modules: list[str]) -> bool:
+    ok = True
+    for module in modules:
+        elapsed, imported = measure(module)
+        budget = BUDGETS.get(module)
+
+        eager = [x for x in LAZY_MODULES if x in imported]
+        over = budget is not None and elapsed > budget
+        ok = ok and not eager and not over
+
+        status = "FAIL" if eager or over else "ok"
+        budget_str = f"{budget} ms" if budget is not None else "no budget"
+        print(f"{status:<4} | {module:<24} | {elapsed:>7.1f} ms ({budget_str})")
+        if eager:
+            print(f"     | imports {', '.join(eager)} eagerly")
+
+    return ok
+
+
+if __name__ == "__main__":
+    modules = sys.argv[1:] or list(BUDGETS)
+    sys.exit(0 if check(modules) else 1)
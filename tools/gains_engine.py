@@ -0,0 +1,240 @@
+import bisect
+import time
+from array import array
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Callable, Iterable
+
+from classes.services.rate_service import RateService, StalenessPolicy
+from tools.calc_wallet import Wad, Wallet
+from utils import instrument
+
+
+@dataclass
+class GainsTable:
+    """
+    One row per realized deduction, staking reward and open lot, stored column-wise
+    Each row is valued twice: the cost leg (what was given up / paid) and the value leg (what it's worth),
+    so gain = value - cost for every kind. Staking rewards have no cost leg.
+    """
+
+    kind: list[str] = field(default_factory=list)
+    # currency the row is reported under
+    currency: list[str] = field(default_factory=list)
+    # wad the row's cost basis comes from
+    lot: list[Wad] = field(default_factory=list)
+
+    cost_time: array = field(default_factory=lambda: array("d"))
+    cost_quantity: list[Decimal] = field(default_factory=list)
+    cost_currency: list[str | None] = field(default_factory=list)
+
+    value_time: array = field(default_factory=lambda: array("d"))
+    value_quantity: list[Decimal] = field(default_factory=list)
+    value_currency: list[str] = field(default_factory=list)
+
+    @classmethod
+    def from_wallet(cls, wallet: Wallet, now: float) -> "GainsTable":
+        table = cls()
+
+        wads = [wad for stack in wallet.stacks.values() for wad in stack.wads]
+
+        deductions = [ddt for wad in wads for ddt in wad.deductions if ddt.dst]
+        deductions.sort(key=lambda ddt: ddt.tsn.date)
+        for ddt in deductions:
+            table._append(
+                "realized",
+                lot=ddt.src,
+                cost=(ddt.src.tsn.date, ddt.value.quantity, ddt.value.currency),
+                value=(ddt.dst.tsn.date, ddt.dst.total.quantity, ddt.dst.total.currency),  # type: ignore
+            )
+
+        for wad in wads:
+            if wad.tsn.meta.get("type") == "staking":
+                table._append(
+                    "staking",
+                    lot=wad,
+                    cost=(wad.tsn.date, Decimal(0), None),
+                    value=(wad.tsn.date, wad.total.quantity, wad.total.currency),
+                )
+
+        for wad in wads:
+            available = wad.available
+            if available.quantity > 0:
+                table._append(
+                    "unrealized",
+                    lot=wad,
+                    cost=(wad.tsn.date, available.quantity, available.currency),
+                    value=(now, available.quantity, available.currency),
+                )
+
+        return table
+
+    def _append(
+        self,
+        kind: str,
+        lot: Wad,
+        cost: tuple[float, Decimal, str | None],
+        value: tuple[float, Decimal, str],
+    ) -> None:
+        self.kind.append(kind)
+        self.currency.append(value[2])
+        self.lot.append(lot)
+
+        self.cost_time.append(cost[0])
+        self.cost_quantity.append(cost[1])
+        self.cost_currency.append(cost[2])
+
+        self.value_time.append(value[0])
+        self.value_quantity.append(value[1])
+        self.value_currency.append(value[2])
+
+    def __len__(self) -> int:
+        return len(self.kind)
+
+    def lookups(self, id_map: dict[str, str]) -> set[tuple[float, str]]:
+        """Every (timestamp, coin id) rate needed to value the table"""
+        result = set()
+        for times, currencies in [
+            (self.cost_time, self.cost_currency),
+            (self.value_time, self.value_currency),
+        ]:
+            for ts, currency in zip(times, currencies):
+                if currency is not None:
+                    assert currency in id_map, currency
+                    result.add((ts, id_map[currency]))
+        return result
+
+    def evaluate(
+        self, rates: dict[tuple[float, str], tuple[Decimal, float]], id_map: dict[str, str]
+    ) -> "GainsReport":
+        cost_value = self._value_column(
+            self.cost_time, self.cost_quantity, self.cost_currency, rates, id_map
+        )
+        value = self._value_column(
+            self.value_time, self.value_quantity, self.value_currency, rates, id_map
+        )
+        years = _years(self.value_time)
+
+        report = GainsReport()
+        for idx, kind in enumerate(self.kind):
+            gain = value[idx] - cost_value[idx]
+
+            match kind:
+                case "realized":
+                    _add(report.realized, years[idx], gain)
+                case "staking":
+                    _add(report.staking, years[idx], gain)
+                case "unrealized":
+                    totals = report.unrealized.setdefault(
+                        self.currency[idx], [Decimal(0), Decimal(0)]
+                    )
+                    totals[0] += cost_value[idx]
+                    totals[1] += value[idx]
+
+            lot = self.lot[idx]
+            lot_gain = report.lots.setdefault(id(lot), [lot, Decimal(0)])
+            lot_gain[1] += gain
+
+        return report
+
+    @staticmethod
+    def _value_column(
+        times: array,
+        quantities: list[Decimal],
+        currencies: list[str | None],
+        rates: dict[tuple[float, str], tuple[Decimal, float]],
+        id_map: dict[str, str],
+    ) -> list[Decimal]:
+        return [
+            quantity * rates[(ts, id_map[currency])][0] if currency else Decimal(0)
+            for ts, quantity, currency in zip(times, quantities, currencies)
+        ]
+
+
+@dataclass
+class GainsReport:
+    # year -> total
+    realized: dict[int, Decimal] = field(default_factory=dict)
+    staking: dict[int, Decimal] = field(default_factory=dict)
+    # currency -> [cost basis, current value] of the open lots
+    unrealized: dict[str, list[Decimal]] = field(default_factory=dict)
+    # id(wad) -> [wad, total gain attributed to it]
+    lots: dict[int, list] = field(default_factory=dict)
+
+    @property
+    def with_staking(self) -> dict[int, Decimal]:
+        result = dict(self.realized)
+        for year, gain in self.staking.items():
+            _add(result, year, gain)
+        return dict(sorted(result.items()))
+
+
+# samples more than a day off are refetched, and raise if they still are,
+# a gain valued at the wrong price is worse than no report
+STALENESS = StalenessPolicy(historical=86400, strict=True)
+
+
+def compute_gains(
+    wallet: Wallet,
+    service: RateService,
+    id_map: dict[str, str],
+    now: float | None = None,
+    vs_currency="usd",
+) -> GainsReport:
+    """Values every realized trade, staking reward and open lot in one pass, with one batched rate lookup"""
+    if now is None:
+        now = time.time()
+
+    with instrument.stage("gains.table"):
+        table = GainsTable.from_wallet(wallet, now)
+        lookups = table.lookups(id_map)
+    instrument.count("gains.rows", len(table))
+
+    with instrument.stage("gains.rates"):
+        service.prefetch(lookups, vs_currency, staleness=STALENESS)
+        rates = service.get_rates(lookups, vs_currency, staleness=STALENESS)
+
+    with instrument.stage("gains.evaluate"):
+        return table.evaluate(rates, id_map)
+
+
+def unit_cost(
+    service: RateService,
+    lookups: Iterable[tuple[float, str]],
+    id_map: dict[str, str],
+    vs_currency="usd",
+) -> Callable[[Wad], Decimal]:
+    """
+    Cost function for the hifo / lofo lot methods: price of the wad's currency when it was acquired
+    lookups ((timestamp, coin id) of when wads may be acquired) are fetched up front,
+    the costs are then read from the cache, so the replay never waits on the network
+    """
+    service.prefetch(lookups, vs_currency)
+
+    def cost(wad: Wad) -> Decimal:
+        currency = wad.total.currency
+        assert currency in id_map, currency
+        key = (wad.tsn.date, id_map[currency])
+        rate, _ = service.get_rates([key], vs_currency)[key]
+        return rate
+
+    return cost
+
+
+def _add(totals: dict, key, amount: Decimal) -> None:
+    totals[key] = totals.get(key, Decimal(0)) + amount
+
+
+def _years(times: array) -> list[int]:
+    """UTC year of each timestamp, by bisecting the new-year boundaries instead of building datetimes"""
+    if not times:
+        return []
+
+    first = datetime.fromtimestamp(min(times), tz=timezone.utc).year
+    last = datetime.fromtimestamp(max(times), tz=timezone.utc).year
+    boundaries = [
+        datetime(year, 1, 1, tzinfo=timezone.utc).timestamp()
+        for year in range(first + 1, last + 1)
+    ]
+    return [first + bisect.bisect_right(boundaries, ts) for ts in times]
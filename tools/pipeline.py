@@ -0,0 +1,93 @@
+import logging
+from functools import cached_property
+from typing import Iterator
+
+from classes.services.cross_rate_service import CrossRateService
+from classes.services.gecko_service import GeckoService
+from classes.services.kraken_service import (
+    HistoryItem,
+    HistoryTable,
+    KrakenService,
+    merge_histories,
+)
+from config.gecko_currency_map import K2G_ID_MAP
+from tools.calc_wallet import WALLET_CHECKPOINT, HistoryParser, Wallet
+from tools.gains_engine import GainsReport, compute_gains, unit_cost
+
+LOG = logging.getLogger(__name__)
+
+
+class Pipeline:
+    """
+    State shared by the reports of a single run
+    Each stage is built on first use and then reused, so running several reports
+    loads the ledger, replays the wallet and warms the rate cache only once
+    """
+
+    def __init__(
+        self,
+        live=False,
+        method="fifo",
+        vs_currency="usd",
+        checkpoint=False,
+        interpolate=False,
+    ) -> None:
+        # pull new ledger entries before replaying
+        self.live = live
+        # resume the wallet from WALLET_CHECKPOINT, only faster than a replay on large ledgers
+        self.checkpoint = checkpoint
+        self.method = method
+        # currency the gains are valued in, usd or a gecko coin id
+        self.vs_currency = vs_currency
+        # value deposits between the two samples around them, instead of at the closest one
+        self.interpolate = interpolate
+        self.id_map = K2G_ID_MAP
+
+    @cached_property
+    def krakens(self) -> list[KrakenService]:
+        """One service per configured kraken account"""
+        return KrakenService.accounts()
+
+    @cached_property
+    def gecko(self) -> GeckoService:
+        return GeckoService()
+
+    @cached_property
+    def rates(self) -> CrossRateService:
+        """Rates between any two coins, derived from the cached usd series"""
+        return CrossRateService(self.gecko, quote="usd")
+
+    @cached_property
+    def histories(self) -> list[HistoryTable]:
+        return KrakenService.fetch_histories(self.krakens, live=self.live)
+
+    @property
+    def history(self) -> Iterator[HistoryItem]:
+        """Every account's ledger, merged by time"""
+        return merge_histories(self.histories)
+
+    @cached_property
+    def wallet(self) -> Wallet:
+        cost = None
+        if self.method in ["hifo", "lofo"]:
+            # wads are acquired within a pair window of some ledger row of their currency
+            lookups = set()
+            for table in self.histories:
+                for time, asset in zip(table.time, table.asset):
+                    currency = HistoryParser.CURRENCY_MAP.get(asset, asset)
+                    if currency in self.id_map:
+                        lookups.add((time, self.id_map[currency]))
+            cost = unit_cost(self.rates, lookups, self.id_map, self.vs_currency)
+
+        return Wallet.from_history(
+            self.histories,
+            checkpoint=WALLET_CHECKPOINT if self.checkpoint else None,
+            method=self.method,
+            cost=cost,
+        )
+
+    @cached_property
+    def gains(self) -> GainsReport:
+        return compute_gains(
+            self.wallet, self.rates, self.id_map, vs_currency=self.vs_currency
+        )
@@ -0,0 +1,88 @@
+"""
+Runs one or more reports over a single shared pipeline
+python -m tools.stonks wallet gains deposits unrealized
+"""
+
+import argparse
+import sys
+from typing import Callable
+
+from config import paths
+from config.configure_logging import configure_logging
+from tools import calc_deposits, calc_gains, calc_wallet
+from tools.calc_wallet import LOT_METHODS
+from tools.pipeline import Pipeline
+from utils import instrument
+from utils.misc import share_limits
+
+REPORTS: dict[str, Callable[[Pipeline], None]] = {
+    "wallet": calc_wallet.run,
+    "gains": calc_gains.run,
+    "unrealized": calc_gains.run_unrealized,
+    "deposits": calc_deposits.run,
+}
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="stonks")
+    parser.add_argument("reports", nargs="+", choices=list(REPORTS))
+    parser.add_argument(
+        "--live", action="store_true", help="fetch new ledger entries first"
+    )
+    parser.add_argument("--method", choices=LOT_METHODS, default="fifo")
+    parser.add_argument(
+        "--checkpoint",
+        action="store_true",
+        help="resume the wallet from the last run's checkpoint, worth it for ledgers of ~20k rows and up",
+    )
+    parser.add_argument(
+        "--vs",
+        default="usd",
+        help="value the gains in this currency, eg usd or a gecko coin id like bitcoin",
+    )
+    parser.add_argument(
+        "--interpolate",
+        action="store_true",
+        help="value deposits linearly between the samples around them instead of at the closest one",
+    )
+    parser.add_argument(
+        "--share-limits",
+        action="store_true",
+        help="split the api rate limits with other stonks processes on this machine",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="print stage timings and counters to stderr when done",
+    )
+    parser.add_argument("--profile-format", choices=["table", "json"], default="table")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+    configure_logging()
+    if args.profile:
+        instrument.enable()
+    if args.share_limits:
+        share_limits(paths.CACHE_DIR / "limits")
+
+    ctx = Pipeline(
+        live=args.live,
+        method=args.method,
+        vs_currency=args.vs,
+        checkpoint=args.checkpoint,
+        interpolate=args.interpolate,
+    )
+    # each report only runs once, even if listed twice
+    for name in dict.fromkeys(args.reports):
+        with instrument.stage(f"report.{name}"):
+            REPORTS[name](ctx)
+
+    if args.profile:
+        summary = instrument.summary()
+        print(instrument.format_summary(summary, args.profile_format), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Opt-in timers and counters for the hot paths
+Everything is a no-op until enable() is called, so the calls can stay in place permanently
+"""
+
+import contextlib
+import json
+import threading
+import time
+
+ENABLED = False
+
+# name -> [calls, total seconds]
+TIMERS: dict[str, list] = dict()
+# name -> total
+COUNTERS: dict[str, int] = dict()
+
+_LOCK = threading.Lock()
+_NULL = contextlib.nullcontext()
+
+
+class _Stage:
+    __slots__ = ["name", "start"]
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def enable() -> None:
+    global ENABLED
+    ENABLED = True
+
+
+def reset() -> None:
+    with _LOCK:
+        TIMERS.clear()
+        COUNTERS.clear()
+
+
+def stage(name: str):
+    """Context manager that adds its wall time to the timer {name}"""
+    return _Stage(name) if ENABLED else _NULL
+
+
+def add_time(name: str, seconds: float) -> None:
+    if not ENABLED:
+        return
+    with _LOCK:
+        timer = TIMERS.setdefault(name, [0, 0.0])
+        timer[0] += 1
+        timer[1] += seconds
+
+
+def count(name: str, n: int = 1) -> None:
+    if not ENABLED:
+        return
+    with _LOCK:
+        COUNTERS[name] = COUNTERS.get(name, 0) + n
+
+
+def summary() -> dict:
+    """
+    Timers, counters, and the throughput of every counter that shares its name with a timer
+    (so count("wallet.replay", n) inside stage("wallet.replay") reports items per second)
+    """
+    with _LOCK:
+        timers = {k: dict(calls=v[0], seconds=v[1]) for k, v in sorted(TIMERS.items())}
+        counters = dict(sorted(COUNTERS.items()))
+
+    throughput = {
+        name: total / timers[name]["seconds"]
+        for name, total in counters.items()
+        if name in timers and timers[name]["seconds"] > 0
+    }
+    return dict(timers=timers, counters=counters, throughput=throughput)
+
+
+def format_summary(data: dict, format="table") -> str:
+    if format == "json":
+        return json.dumps(data, indent=2)
+
+    lines = ["", "timers"]
+    for name, timer in data["timers"].items():
+        lines.append(
+            f"  {name:<36} | {timer['seconds'] * 1000:>10.1f} ms | {timer['calls']:>6} calls"
+        )
+
+    lines.append("counters")
+    for name, total in data["counters"].items():
+        rate = data["throughput"].get(name)
+        rate_str = f" | {rate:>10.0f} / s" if rate is not None else ""
+        lines.append(f"  {name:<36} | {total:>10}{rate_str}")
+
+    return "\n".join(lines)
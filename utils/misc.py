@@ -1,69 +1,221 @@
+import contextlib
 import functools
-from typing import Union
+import gc
+import os
+from collections import namedtuple
+from typing import IO, Callable, Iterator, Union
 from pathlib import Path
 
-from classes.json_cache import JsonCache
+from classes.rate_limiter import RateLimiter
+from utils import instrument
 
 
-def memoize(fp: Union[Path, str]):
-    import functools
+CacheInfo = namedtuple(
+    "CacheInfo", ["hits", "disk_hits", "misses", "maxsize", "currsize", "pending"]
+)
 
-    cache_file = JsonCache(fp, default=dict())
+
+def memoize(
+    fp: Union[Path, str],
+    maxsize: int = 1024,
+    batch_size: int = 32,
+    flush_interval: float = 60,
+):
+    """
+    Persistent memoization for methods (the first arg is treated as self and left out of the key)
+    Arguments are bound to the signature first, so f(2, y=3) and f(x=2, y=3) share an entry
+    Results live in a bounded in-memory LRU and new entries are written to disk in batches,
+    once batch_size entries are pending, flush_interval seconds after the oldest pending one, or at exit
+    """
+    import atexit
+    import hashlib
+    import inspect
+    import json
+    import threading
+    from collections import OrderedDict
+
+    from classes.sqlite_cache import SqliteCache
+
+    missing = object()
 
     def decorator(f):
+        store = SqliteCache(fp, default=dict, namespace=f.__qualname__)
+        signature = inspect.signature(f)
+        lru: OrderedDict = OrderedDict()
+        pending: dict = dict()
+        stats = dict(hits=0, disk_hits=0, misses=0)
+        lock = threading.RLock()
+        # background flush, armed by the first pending entry
+        timer: threading.Timer | None = None
+
+        def flush():
+            nonlocal timer
+            with lock:
+                if timer is not None:
+                    timer.cancel()
+                    timer = None
+                if pending:
+                    store.put(pending)
+                    pending.clear()
+
+        def schedule_flush():
+            nonlocal timer
+            if timer is None:
+                timer = threading.Timer(flush_interval, flush)
+                timer.daemon = True
+                timer.start()
+
+        def remember(key, value):
+            lru[key] = value
+            lru.move_to_end(key)
+            if len(lru) > maxsize:
+                lru.popitem(last=False)
+
         @functools.wraps(f)
         def wrapper(*args, **kwargs):
-            hash = list(args[1:]) + sorted(kwargs.items(), key=lambda k,v: k)
-            hash = str(hash)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            raw = json.dumps(
+                [bound.args[1:], sorted(bound.kwargs.items())], default=str
+            )
+            key = hashlib.sha256(raw.encode()).hexdigest()
+
+            with lock:
+                if key in lru:
+                    stats["hits"] += 1
+                    instrument.count(f"memoize.{f.__qualname__}.hits")
+                    lru.move_to_end(key)
+                    return lru[key]
+
+                result = pending.get(key, missing)
+                if result is missing:
+                    result = store.get(key, missing)
+                if result is not missing:
+                    stats["disk_hits"] += 1
+                    instrument.count(f"memoize.{f.__qualname__}.disk_hits")
+                    remember(key, result)
+                    return result
+
+            stats["misses"] += 1
+            instrument.count(f"memoize.{f.__qualname__}.misses")
+            result = f(*args, **kwargs)
 
-            if not fp.parent.exists():
-                fp.parent.mkdir(parents=True, exist_ok=True)
+            with lock:
+                remember(key, result)
+                pending[key] = result
+                if len(pending) >= batch_size:
+                    flush()
+                else:
+                    schedule_flush()
 
-            data = cache_file.load()
-    
-            if hash not in data:
-                result = f(*args, **kwargs)
-                data[hash] = result
+            return result
 
-            cache_file.dump(data)
+        def cache_info() -> CacheInfo:
+            return CacheInfo(maxsize=maxsize, currsize=len(lru), pending=len(pending), **stats)
 
-            return data[hash]
+        atexit.register(flush)
+        wrapper.flush = flush  # type: ignore
+        wrapper.cache_info = cache_info  # type: ignore
         return wrapper
+
     return decorator
 
 
-CALL_LOG = dict()
-def limit(calls: int, period: float = 1, scope = ''):
-    import time
+LIMITERS: dict[str, RateLimiter] = dict()
+
+
+# directory holding the shared limiter files, see share_limits()
+SHARED_LIMITS_DIR: Path | None = None
+
+
+def get_limiter(scope: str) -> RateLimiter:
+    limiter = LIMITERS.get(scope)
+    if limiter is None:
+        limiter = LIMITERS[scope] = RateLimiter()
+        if SHARED_LIMITS_DIR is not None:
+            limiter.path = SHARED_LIMITS_DIR / f"{scope or 'default'}.json"
+    return limiter
+
+
+def share_limits(directory: Union[Path, str]) -> None:
+    """
+    Keep every limiter's state in {directory}/{scope}.json, so local processes that
+    all call this with the same directory split each scope's budget between them
+    """
+    global SHARED_LIMITS_DIR
+    SHARED_LIMITS_DIR = Path(directory)
+    for scope, limiter in LIMITERS.items():
+        limiter.path = SHARED_LIMITS_DIR / f"{scope or 'default'}.json"
 
-    CALL_LOG.setdefault(scope, [])
+
+def limit(calls: int, period: float = 1, scope: str | Callable[..., str] = ""):
+    """
+    Allow at most {calls} calls per {period} seconds across everything decorated with the same scope
+    scope can also be a function of the call's arguments (eg. lambda self, *args: self.scope) for per-instance budgets
+    Works for plain and async functions, and is safe to call from several threads
+    """
+    import inspect
+
+    if callable(scope):
+        get_scope = scope
+    else:
+        get_limiter(scope)
+        get_scope = lambda *args, **kwargs: scope
 
     def decorator(f):
-        @functools.wraps(f)
-        def wrapper(*args, **kwargs):
-            history = CALL_LOG[scope]
-            now = time.time()
+        if inspect.iscoroutinefunction(f):
 
-            while True:
-                if len(history) == 0:
-                    break
+            @functools.wraps(f)
+            async def async_wrapper(*args, **kwargs):
+                name = get_scope(*args, **kwargs)
+                waited = await get_limiter(name).acquire_async(calls, period)
+                instrument.add_time(f"rate_limit_sleep.{name}", waited)
+                instrument.count(f"api_calls.{name}")
+                return await f(*args, **kwargs)
 
-                elapsed = now - history[0]
-                if elapsed > period:
-                    history.pop(0)
-                else:
-                    break
-            
-            if len(history) >= calls:
-                oldest = history[0]
-                elapsed = now - oldest
-                rem = period - elapsed
-                if rem >= 0:
-                    time.sleep(rem)
-                    history.pop(0)
+            return async_wrapper
+
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            name = get_scope(*args, **kwargs)
+            waited = get_limiter(name).acquire(calls, period)
+            instrument.add_time(f"rate_limit_sleep.{name}", waited)
+            instrument.count(f"api_calls.{name}")
+            return f(*args, **kwargs)
 
-            result = f(*args, **kwargs)
-            history.append(time.time())
-            return result
         return wrapper
+
     return decorator
+
+
+@contextlib.contextmanager
+def atomic_write(fp: Path, mode="wb", encoding: str | None = None) -> Iterator[IO]:
+    """
+    File to write fp's new contents to, swapped in once the block exits without raising
+    It's a sibling file until then, so a crash mid-write leaves the old contents intact
+    """
+    os.makedirs(fp.parent, exist_ok=True)
+    tmp = fp.with_name(fp.name + ".tmp")
+    with open(tmp, mode, encoding=encoding) as file:
+        yield file
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp, fp)
+
+
+@contextlib.contextmanager
+def gc_paused():
+    """
+    Suspends the cyclic garbage collector, for building large object graphs that are all still in use
+    Otherwise every few thousand allocations trigger a collection that walks everything built so far.
+    One collection on the way out then moves it all to the oldest generation in a single pass,
+    instead of the next few young collections each walking it.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+            gc.collect()